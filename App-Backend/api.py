@@ -2,28 +2,44 @@
 FastAPI application - REST API endpoints for scheduled message system.
 """
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.staticfiles import StaticFiles
+from jose import JWTError
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
 import uuid
 import os
+import logging
 from dotenv import load_dotenv
 import shutil
 from pathlib import Path
 
-from database import get_db, init_db, get_user_by_username
+from database import get_db, get_pool_stats, init_db, get_user_by_username
 from schemas import (
+    SignInResponse,
     User,
     UserCreate,
     UserSignIn
 )
 
-from auth import create_user, verify_password
+from auth import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    PasswordHasherBusy,
+    create_access_token,
+    create_user,
+    decode_access_token,
+    needs_rehash,
+    password_hasher,
+    update_password_hash,
+)
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Create FastAPI application
 app = FastAPI(
     title="Scheduled Message API",
@@ -35,28 +51,103 @@ app = FastAPI(
 # Base URL for file access
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 
+bearer_scheme = HTTPBearer(auto_error=False)
+
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize database and start background tasks on startup"""
     init_db()
+    password_hasher.start()
+    if not os.getenv("JWT_SECRET_KEY"):
+        logger.warning("JWT_SECRET_KEY is not set; access tokens will not survive a restart")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the password hashing workers"""
+    password_hasher.shutdown()
+
+
+def hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-ins in progress, retry shortly",
+        headers={"Retry-After": "1"}
+    )
 
 
+async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)) -> User:
+    """Dependency that authenticates the caller from its access token, without a database lookup"""
+    unauthorized = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or expired access token",
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+    if credentials is None or credentials.scheme.lower() != "bearer":
+        raise unauthorized
+    try:
+        claims = decode_access_token(credentials.credentials)
+    except JWTError:
+        raise unauthorized
+    return User(username=claims["sub"], uuid=claims["uuid"])
+
+
+# Endpoints are async so bcrypt runs in the hashing workers and only the
+# short database calls use the request threadpool
 @app.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = get_user_by_username(db, username=user.username)
+async def register(user: UserCreate, db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(get_user_by_username, db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return create_user(db=db, user=user)
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except PasswordHasherBusy:
+        raise hasher_busy()
+    return await run_in_threadpool(create_user, db=db, user=user, hashed_password=hashed_password)
 
-@app.post("/sign-in", response_model=User)
-def sign_in(user: UserSignIn, db: Session = Depends(get_db)):
-    db_user = get_user_by_username(db, username=user.username)
+@app.post("/sign-in", response_model=SignInResponse)
+async def sign_in(user: UserSignIn, db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(get_user_by_username, db, username=user.username)
     if not db_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-    if not verify_password(user.password, db_user.hashed_password):
+    try:
+        verified = await password_hasher.verify(user.password, db_user.hashed_password)
+    except PasswordHasherBusy:
+        raise hasher_busy()
+    if not verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
-    return db_user
+
+    # Upgrade the hash to the configured cost while the password is at hand
+    if needs_rehash(db_user.hashed_password):
+        try:
+            hashed_password = await password_hasher.hash(user.password)
+            await run_in_threadpool(update_password_hash, db, db_user, hashed_password)
+        except PasswordHasherBusy:
+            pass  # Next sign-in will retry
+
+    return SignInResponse(
+        username=db_user.username,
+        uuid=db_user.uuid,
+        access_token=create_access_token(db_user),
+        token_type="bearer",
+        expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    )
+
+@app.get("/me", response_model=User)
+async def me(current_user: User = Depends(get_current_user)):
+    """The signed-in user, from the access token"""
+    return current_user
+
+@app.get("/db-stats")
+def db_stats():
+    """Database connection pool statistics"""
+    return get_pool_stats()
+
+@app.get("/hasher-stats")
+async def hasher_stats():
+    """Password hashing pool occupancy"""
+    return password_hasher.stats()
 
 @app.get("/")
 async def root():
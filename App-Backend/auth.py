@@ -3,24 +3,135 @@ from sqlalchemy.orm import Session
 from models import User
 from schemas import UserCreate
 import os
+import asyncio
 import base64
+import multiprocessing
+import secrets
+import threading
 import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from jose import jwt
+
+# Read before the settings below, which are fixed at import time
+load_dotenv()
+
+# bcrypt cost factor for new hashes. Hashes of another cost are upgraded on
+# the next successful sign-in, so it can be raised (or lowered) at any time.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Hashing and checking run in a dedicated process pool, off the event loop
+# and the request threadpool. At most PASSWORD_HASH_MAX_PENDING operations
+# are queued or running; beyond that sign-ins and registrations fail fast
+# with 503.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(os.cpu_count() or 1, 4))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))
+
+# Access tokens are HMAC-signed JWTs, verified without a database lookup.
+# Without JWT_SECRET_KEY a random key is used, so tokens only stay valid
+# for the lifetime of the process.
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY") or secrets.token_urlsafe(32)
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when PASSWORD_HASH_MAX_PENDING hashing operations are already pending"""
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifies the password against the given hash"""
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
-def get_password_hash(password: str) -> str:
+def get_password_hash(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
     """Hashes the password"""
     pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds)
     return bcrypt.hashpw(pwd_bytes, salt).decode('utf-8')
 
-def create_user(db: Session, user: UserCreate) -> User:
-    hashed_password = get_password_hash(user.password)
+def needs_rehash(hashed_password: str) -> bool:
+    """Whether the hash was made with a cost other than BCRYPT_ROUNDS"""
+    # Format: $2b$<cost>$<salt and hash>
+    return int(hashed_password.split('$')[2]) != BCRYPT_ROUNDS
+
+
+class PasswordHasher:
+    """Bounded process pool for bcrypt, started on first use"""
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that already runs threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    async def _run(self, function, *args):
+        if self.pending >= self.max_pending:
+            raise PasswordHasherBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), function, *args)
+        finally:
+            self.pending -= 1
+
+    def start(self) -> None:
+        """Start the workers ahead of the first sign-in"""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(int)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password, BCRYPT_ROUNDS)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "max_pending": self.max_pending, "pending": self.pending}
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+
+def create_access_token(user: User) -> str:
+    """Signed access token for the user, valid for ACCESS_TOKEN_EXPIRE_MINUTES"""
+    now = datetime.now(timezone.utc)
+    claims = {
+        "sub": user.username,
+        "uuid": user.uuid,
+        "iat": now,
+        "exp": now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    }
+    return jwt.encode(claims, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+def decode_access_token(token: str) -> dict:
+    """Claims of a valid access token; raises jose.JWTError otherwise"""
+    return jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+
+def create_user(db: Session, user: UserCreate, hashed_password: str) -> User:
     admin_id = str(uuid.uuid4())
     db_user = User(username=user.username, hashed_password=hashed_password, uuid=admin_id)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
+
+def update_password_hash(db: Session, db_user: User, hashed_password: str) -> None:
+    db_user.hashed_password = hashed_password
+    db.commit()
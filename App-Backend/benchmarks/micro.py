@@ -0,0 +1,221 @@
+"""
+Micro-benchmarks - Repeatable timings of the account service's hot paths.
+
+- verify_password: bcrypt.checkpw through auth.verify_password, per cost
+  factor
+- user_lookup: get_user_by_username against a generated SQLite database of
+  `size` users
+- sign_in: POST /sign-in end to end (lookup, password check in the hashing
+  workers, token issue) against the same database, with passwords hashed at
+  --sign-in-cost
+- access_token_verify / me: decoding an access token, and GET /me end to end
+- login_storm: --storm-concurrency concurrent sign-ins, with GET /db-stats
+  timed alongside to show whether other endpoints stay responsive
+
+Each benchmark runs until it has at least --min-rounds rounds and
+--min-seconds of timed work, after untimed warmup rounds. The report is
+written with the engine's Telegram-Engine/benchmarks/report.py, so
+Telegram-Engine/benchmarks/compare.py compares two runs.
+
+Run with: python benchmarks/micro.py --sizes 1000,10000,100000 --costs 4,10,12
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+# The report format is shared with the engine's benchmarks
+sys.path.append(str(BACKEND_DIR.parent / "Telegram-Engine" / "benchmarks"))
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+# Shared with the hashing workers, which re-import this module
+WORKDIR = Path(os.environ.get("MICRO_BENCHMARKS_WORKDIR") or tempfile.mkdtemp(prefix="micro-benchmarks-"))
+os.environ["MICRO_BENCHMARKS_WORKDIR"] = str(WORKDIR)
+
+# The service reads its configuration at import time
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR / 'micro.db'}"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import bcrypt  # noqa: E402
+from report import percentiles, write_report  # noqa: E402
+import httpx  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+import api  # noqa: E402
+import auth  # noqa: E402
+from auth import decode_access_token, password_hasher, verify_password  # noqa: E402
+from database import SessionLocal, engine, get_user_by_username, init_db  # noqa: E402
+from models import Base, User  # noqa: E402
+
+SEED = 20240101
+WARMUP_ROUNDS = 2
+SEED_CHUNK_SIZE = 5000
+PASSWORD = "correct horse battery staple"
+
+
+class Settings:
+    """Round limits, overridden from the command line"""
+    min_rounds = 5
+    min_seconds = 1.0
+    max_rounds = 10000
+
+
+def measure(operation: Callable[[], object]) -> dict:
+    """Time `operation` repeatedly"""
+    times: List[float] = []
+    round_number = 0
+    while True:
+        started = time.perf_counter()
+        operation()
+        elapsed = time.perf_counter() - started
+        round_number += 1
+        if round_number > WARMUP_ROUNDS:
+            times.append(elapsed)
+            if len(times) >= Settings.max_rounds or (
+                len(times) >= Settings.min_rounds and sum(times) >= Settings.min_seconds
+            ):
+                break
+    return {
+        "rounds": len(times),
+        "ops_per_second": len(times) / sum(times),
+        **percentiles((t * 1000 for t in times), prefix="ms_"),
+    }
+
+
+def generate_database(size: int, hashed_password: str) -> List[str]:
+    """Recreate the users table with `size` users sharing one password hash"""
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    rng = random.Random(SEED + size)
+    usernames = [f"user-{i}-{rng.getrandbits(32):08x}" for i in range(size)]
+    rows = [
+        {"username": username, "hashed_password": hashed_password, "uuid": f"{rng.getrandbits(128):032x}"}
+        for username in usernames
+    ]
+    with SessionLocal() as db:
+        for start in range(0, len(rows), SEED_CHUNK_SIZE):
+            db.execute(insert(User), rows[start:start + SEED_CHUNK_SIZE])
+        db.commit()
+    return usernames
+
+
+def bench_verify_password(costs: List[int]) -> Dict[str, dict]:
+    """auth.verify_password against a hash of each cost factor"""
+    results = {}
+    for cost in costs:
+        hashed = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(cost)).decode("utf-8")
+        results[f"verify_password[cost={cost}]"] = measure(lambda: verify_password(PASSWORD, hashed))
+    return results
+
+
+def bench_accounts(sizes: List[int], sign_in_cost: int, storm_concurrency: int) -> Dict[str, dict]:
+    """Username lookup and POST /sign-in per generated database size, then token checks and a login storm"""
+    results = {}
+    hashed = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(sign_in_cost)).decode("utf-8")
+    rng = random.Random(SEED)
+    with TestClient(api.app) as client:
+        for size in sizes:
+            print(f"[size {size}] generating database", file=sys.stderr)
+            usernames = generate_database(size, hashed)
+
+            def lookup():
+                with SessionLocal() as db:
+                    get_user_by_username(db, rng.choice(usernames))
+
+            def sign_in():
+                response = client.post("/sign-in", json={"username": rng.choice(usernames), "password": PASSWORD})
+                response.raise_for_status()
+
+            results[f"user_lookup[size={size}]"] = measure(lookup)
+            results[f"sign_in[size={size},cost={sign_in_cost}]"] = measure(sign_in)
+
+        token = client.post("/sign-in", json={"username": usernames[0], "password": PASSWORD}).json()["access_token"]
+
+        def me():
+            client.get("/me", headers={"Authorization": f"Bearer {token}"}).raise_for_status()
+
+        results["access_token_verify"] = measure(lambda: decode_access_token(token))
+        results["me"] = measure(me)
+
+    key = f"login_storm[concurrency={storm_concurrency},cost={sign_in_cost}]"
+    results[key] = asyncio.run(login_storm(usernames, storm_concurrency, storm_concurrency * 4))
+    password_hasher.shutdown()
+    return results
+
+
+async def login_storm(usernames: List[str], concurrency: int, requests: int) -> dict:
+    """`requests` sign-ins, `concurrency` at a time, with GET /db-stats timed meanwhile"""
+    rng = random.Random(SEED)
+    transport = httpx.ASGITransport(app=api.app)
+    sign_in_times: List[float] = []
+    other_times: List[float] = []
+    statuses: Dict[int, int] = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://micro") as client:
+        queue = iter(range(requests))
+
+        async def signer():
+            for _ in queue:
+                started = time.perf_counter()
+                response = await client.post("/sign-in", json={"username": rng.choice(usernames), "password": PASSWORD})
+                sign_in_times.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        signers = [asyncio.create_task(signer()) for _ in range(concurrency)]
+        started = time.perf_counter()
+        while not all(task.done() for task in signers):
+            probe = time.perf_counter()
+            (await client.get("/db-stats")).raise_for_status()
+            other_times.append(time.perf_counter() - probe)
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        await asyncio.gather(*signers)
+    return {
+        "requests": requests,
+        "sign_ins_per_second": statuses.get(200, 0) / elapsed,
+        "rejected": statuses.get(503, 0),
+        **percentiles((t * 1000 for t in sign_in_times), prefix="sign_in_ms_"),
+        **percentiles((t * 1000 for t in other_times), prefix="db_stats_ms_"),
+    }
+
+
+def main() -> None:
+    """Run the micro-benchmarks and write the report"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated user counts of the generated database")
+    parser.add_argument("--costs", default="4,10,12", help="Comma-separated bcrypt cost factors for verify_password")
+    parser.add_argument("--sign-in-cost", type=int, default=12, help="bcrypt cost of the generated users' hashes")
+    parser.add_argument("--storm-concurrency", type=int, default=32, help="Concurrent sign-ins in login_storm")
+    parser.add_argument("--min-rounds", type=int, default=Settings.min_rounds)
+    parser.add_argument("--min-seconds", type=float, default=Settings.min_seconds)
+    parser.add_argument("--max-rounds", type=int, default=Settings.max_rounds)
+    parser.add_argument("--output", type=Path, help="Report path (default: results/app_backend_micro-<commit>.json)")
+    args = parser.parse_args()
+
+    Settings.min_rounds = args.min_rounds
+    Settings.min_seconds = args.min_seconds
+    Settings.max_rounds = args.max_rounds
+    # Sign-ins would otherwise rehash the generated users to the default cost
+    auth.BCRYPT_ROUNDS = args.sign_in_cost
+
+    try:
+        results = bench_verify_password([int(value) for value in args.costs.split(",")])
+        results.update(bench_accounts([int(value) for value in args.sizes.split(",")], args.sign_in_cost, args.storm_concurrency))
+    finally:
+        engine.dispose()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    path = write_report("app_backend_micro", config, results, args.output, results_dir=RESULTS_DIR)
+    print(f"Report written to {path}", file=sys.stderr)
+    print(path.read_text())
+
+
+if __name__ == "__main__":
+    main()
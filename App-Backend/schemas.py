@@ -22,3 +22,6 @@ class UserSignIn(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+
+class SignInResponse(User, Token):
+    expires_in: int
@@ -1,26 +1,61 @@
 """
 FastAPI application - REST API endpoints for scheduled message system.
 """
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, status, Query
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from pydantic import ValidationError
+from sqlalchemy import delete, func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
+import base64
+import hashlib
+import json
+import time
 import uuid
 import os
 from dotenv import load_dotenv
-import shutil
-from pathlib import Path
 
-from database import get_db, init_db
-from models import ScheduledMessage, SubscribedUser
+from attachment_store import (
+    MAX_UPLOAD_REQUEST_BYTES,
+    UPLOAD_DIR,
+    InvalidForm,
+    UploadTooLarge,
+    add_references,
+    commit_files,
+    discard_incoming,
+    init_store,
+    receive_form,
+    release_references,
+    remove_unreferenced,
+    stored_path
+)
+from database import SessionLocal, get_db, get_pool_stats, init_db, upsert_insert
+import metrics
+from models import AudienceGroup, AudienceGroupMember, ScheduledMessage, SubscribedUser
 from schemas import (
+    BulkScheduleMessage,
+    BulkScheduleResponse,
+    GroupCreateRequest,
+    GroupMembersRequest,
+    GroupResponse,
     ScheduleMessageRequest,
     ScheduleMessageResponse,
     SubscribeUserRequest,
-    SubscribeUserResponse
+    SubscribeUserResponse,
+    SubscribeUserResult,
+    SubscriberImportResponse
+)
+from outbox import STATEMENT_CHUNK_SIZE, delete_deliveries
+from recurrence import InvalidRecurrence, validate_recurrence
+from scheduler import (
+    start_message_scheduler,
+    notify_message_scheduled,
+    notify_messages_scheduled,
+    notify_message_deleted
 )
-from scheduler import start_message_scheduler
+from telegram_messenger import subscriber_cache
 
 # Load environment variables
 load_dotenv()
@@ -33,421 +68,797 @@ app = FastAPI(
 )
 
 # Create uploads directory if it doesn't exist
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+init_store()
 
 # Mount static files to serve uploaded files
-app.mount("/files", StaticFiles(directory="uploads"), name="files")
+app.mount("/files", StaticFiles(directory=UPLOAD_DIR), name="files")
 
 # Base URL for file access
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 
+# Page sizes for the list endpoints
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "500"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+# Rows fetched from the server-side cursor per streamed chunk
+STREAM_CHUNK_SIZE = 1000
+
+# Largest number of messages accepted by /schedule-messages
+BULK_SCHEDULE_MAX_MESSAGES = int(os.getenv("BULK_SCHEDULE_MAX_MESSAGES", "10000"))
+
+# Subscribers inserted and committed per transaction by /subscribed-users/import
+SUBSCRIBER_IMPORT_CHUNK_SIZE = int(os.getenv("SUBSCRIBER_IMPORT_CHUNK_SIZE", "5000"))
+
+# Run the delivery scheduler inside this process. main.py turns this off and
+# runs the scheduler as its own process instead.
+EMBEDDED_SCHEDULER = os.getenv("EMBEDDED_SCHEDULER", "true").lower() == "true"
+
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize database and start background tasks on startup"""
-    init_db()
-    start_message_scheduler(app)
+    await init_db()
 
 
-@app.post("/schedule-message", response_model=ScheduleMessageResponse)
-async def schedule_message(
-        from_sender: str = Form(...),
-        target_user_id: str = Form(...),
-        message: str = Form(...),
-        scheduled_timestamp: str = Form(...),
-        files: Optional[List[UploadFile]] = File(None),
-        db: Session = Depends(get_db)
-):
+if EMBEDDED_SCHEDULER:
+    start_message_scheduler(app)
+
+# Receive Telegram updates by webhook instead of a polling bot process.
+# Imported only here because telegram_bot requires TELEGRAM_BOT_TOKEN.
+if os.getenv("TELEGRAM_WEBHOOK_URL"):
+    from telegram_bot import start_webhook
+    start_webhook(app)
+
+
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    """Refuse bodies that declare more than the upload limit before they are read"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_REQUEST_BYTES:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Request body exceeds {MAX_UPLOAD_REQUEST_BYTES} bytes"}
+        )
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Time each request, labelled by route template so ids don't multiply the series"""
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.HTTP_REQUEST_DURATION.labels(
+        request.method,
+        route.path if route is not None else "unmatched",
+        response.status_code
+    ).observe(time.perf_counter() - started)
+    return response
+
+
+@app.post(
+    "/schedule-message",
+    response_model=ScheduleMessageResponse,
+    # The form is parsed from the request stream by receive_form, so it is
+    # described here for the docs rather than with Form/File parameters
+    openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["from_sender", "message", "scheduled_timestamp"],
+        "properties": {
+            "from_sender": {"type": "string"},
+            "target_user_id": {"type": "string"},
+            "target_group_id": {"type": "string"},
+            "message": {"type": "string"},
+            "scheduled_timestamp": {"type": "string"},
+            "recurrence": {"type": "string"},
+            "files": {"type": "array", "items": {"type": "string", "format": "binary"}}
+        }
+    }}}}}
+)
+async def schedule_message(request: Request, db: AsyncSession = Depends(get_db)):
     """
     Schedule a message to be sent at a specific time.
     - **from_sender**: sender IDs that sent message
     - **target_user_id**: Comma-separated list of user IDs
+    - **target_group_id**: Audience group whose members receive the message (with or instead of target_user_id)
     - **message**: The message content
-    - **scheduled_timestamp**: UTC timestamp (ISO 8601 format)
+    - **scheduled_timestamp**: UTC timestamp (ISO 8601 format), the first occurrence if recurring
+    - **recurrence**: Optional cron ("0 9 * * MON") or RRULE ("FREQ=WEEKLY;COUNT=4") expression
     - **files**: Optional list of files to attach
+
+    Files are written to disk as they arrive, and the upload limits are
+    enforced during the transfer.
     """
+    incoming = {}
     try:
-        # Parse target_user_id (comma-separated string to list)
-        target_users = [uid.strip() for uid in target_user_id.split(",")]
+        # Stream the form; uploads are hashed and written without blocking the event loop
+        form, received_files = await receive_form(request)
 
-        # Parse scheduled timestamp
-        scheduled_dt = datetime.fromisoformat(scheduled_timestamp.replace('Z', '+00:00'))
+        # Identical content is stored once, under its hash
+        file_paths = []
+        stored_files = {}
+        for received in received_files:
+            file_path = stored_path(received.content_hash, received.filename)
+            if file_path in incoming:
+                received.incoming_path.unlink(missing_ok=True)
+            else:
+                incoming[file_path] = received.incoming_path
+            stored_files[file_path] = (received.content_hash, received.size)
+            file_paths.append(file_path)
+
+        missing = [name for name in ("from_sender", "message", "scheduled_timestamp") if not form.get(name)]
+        if missing:
+            raise HTTPException(status_code=422, detail=f"Missing form fields: {', '.join(missing)}")
+        from_sender = form["from_sender"]
+        target_user_id = form.get("target_user_id")
+        target_group_id = form.get("target_group_id") or None
+        message = form["message"]
+        scheduled_timestamp = form["scheduled_timestamp"]
+        recurrence = form.get("recurrence")
 
-        # Generate unique ID for this scheduled message
-        message_id = str(uuid.uuid4())
+        # Parse target_user_id (comma-separated string to list)
+        target_users = [uid.strip() for uid in (target_user_id or "").split(",") if uid.strip()]
+        if not target_users and not target_group_id:
+            raise HTTPException(status_code=400, detail="target_user_id or target_group_id is required")
+        if target_group_id and not await db.get(AudienceGroup, target_group_id):
+            raise HTTPException(status_code=404, detail=f"Group {target_group_id} not found")
 
-        # Handle file uploads
-        file_paths = []
-        if files:
-            for file in files:
-                if file.filename:
-                    # Generate unique filename
-                    file_extension = Path(file.filename).suffix
-                    unique_filename = f"{message_id}_{uuid.uuid4()}{file_extension}"
-                    file_path = UPLOAD_DIR / unique_filename
+        # Parse scheduled timestamp, stored as naive UTC
+        scheduled_dt = _naive_utc(datetime.fromisoformat(scheduled_timestamp.replace('Z', '+00:00')))
 
-                    # Save file
-                    with open(file_path, "wb") as buffer:
-                        shutil.copyfileobj(file.file, buffer)
+        if recurrence:
+            recurrence = validate_recurrence(recurrence, scheduled_dt)
 
-                    file_paths.append(str(file_path))
+        # Generate unique ID for this scheduled message
+        message_id = str(uuid.uuid4())
 
         # Create scheduled message record
         scheduled_msg = ScheduledMessage(
             id=message_id,
             from_sender=from_sender,
             target_user_id=target_users,
+            target_group_id=target_group_id,
             message=message,
             scheduled_timestamp=scheduled_dt,
             file_paths=file_paths if file_paths else None,
+            recurrence=recurrence or None,
+            recurrence_start=scheduled_dt if recurrence else None,
             is_sent=False
         )
 
         db.add(scheduled_msg)
-        db.commit()
-        db.refresh(scheduled_msg)
+        await add_references(db, stored_files, file_paths)
+        await db.commit()
+        await db.refresh(scheduled_msg)
+        await commit_files(incoming)
+
+        # Wake the scheduler if this message is now the earliest deadline
+        notify_message_scheduled(scheduled_msg.id, scheduled_msg.scheduled_timestamp)
 
         return scheduled_msg
 
+    except HTTPException:
+        discard_incoming(incoming)
+        raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidForm as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except InvalidRecurrence as e:
+        discard_incoming(incoming)
+        raise HTTPException(status_code=400, detail=str(e))
     except ValueError as e:
+        discard_incoming(incoming)
         raise HTTPException(status_code=400, detail=f"Invalid timestamp format: {str(e)}")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        discard_incoming(incoming)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/subscribe-user", response_model=SubscribeUserResponse)
-async def subscribe_user(
-        user_data: SubscribeUserRequest,
-        db: Session = Depends(get_db)
-):
+@app.post("/schedule-messages", response_model=BulkScheduleResponse)
+async def schedule_messages(request: Request, db: AsyncSession = Depends(get_db)):
     """
-    Subscribe a new user and generate a unique user_id.
+    Schedule many messages in one request.
 
-    - **chat_id**: Unique chat identifier
-    - **chat_name**: Name of the chat/user
+    The body is a JSON array of message specs, or one spec per line with
+    `Content-Type: application/x-ndjson`. Each spec has **from_sender**,
+    **target_user_id** (list or comma-separated string), **message**,
+    **scheduled_timestamp** and optionally **recurrence**. Attachments are
+    not supported here.
+
+    All specs are validated first; if any is invalid nothing is stored and
+    the errors are returned by index. Otherwise the messages are inserted
+    in one transaction and their ids are returned in request order.
     """
+    body = await request.body()
     try:
-        # Check if chat_id already exists
-        existing_user = db.query(SubscribedUser).filter(
-            SubscribedUser.chat_id == user_data.chat_id
-        ).first()
-
-        if existing_user:
-            raise HTTPException(
-                status_code=400,
-                detail=f"User with chat_id {user_data.chat_id} already exists"
-            )
-
-        # Generate random user_id
-        user_id = str(uuid.uuid4())
-
-        # Create new subscribed user
-        new_user = SubscribedUser(
-            user_id=user_id,
-            chat_id=user_data.chat_id,
-            chat_name=user_data.chat_name
+        if "ndjson" in request.headers.get("content-type", ""):
+            specs = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            specs = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
+    if not isinstance(specs, list):
+        raise HTTPException(status_code=400, detail="Expected an array of messages")
+    if len(specs) > BULK_SCHEDULE_MAX_MESSAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {BULK_SCHEDULE_MAX_MESSAGES} messages per request"
         )
 
-        db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+    messages = []
+    spec_indexes = []
+    errors = []
+    for index, spec in enumerate(specs):
+        try:
+            msg = BulkScheduleMessage.model_validate(spec)
+            if msg.recurrence:
+                msg.recurrence = validate_recurrence(msg.recurrence, _naive_utc(msg.scheduled_timestamp))
+            messages.append(msg)
+            spec_indexes.append(index)
+        except ValidationError as e:
+            errors.append({"index": index, "errors": e.errors(include_url=False, include_context=False)})
+        except InvalidRecurrence as e:
+            errors.append({"index": index, "errors": [{"loc": ["recurrence"], "msg": str(e)}]})
+    group_ids = {msg.target_group_id for msg in messages if msg.target_group_id}
+    if group_ids:
+        known_groups = set((await db.scalars(select(AudienceGroup.group_id).where(
+            AudienceGroup.group_id.in_(group_ids)
+        ))).all())
+        for index, msg in zip(spec_indexes, messages):
+            if msg.target_group_id and msg.target_group_id not in known_groups:
+                errors.append({"index": index, "errors": [{"loc": ["target_group_id"], "msg": "Group not found"}]})
+    if errors:
+        raise HTTPException(status_code=422, detail=sorted(errors, key=lambda error: error["index"]))
 
-        return new_user
+    try:
+        now = datetime.utcnow()
+        rows = [
+            {
+                "id": str(uuid.uuid4()),
+                "from_sender": msg.from_sender,
+                "target_user_id": msg.target_user_id,
+                "target_group_id": msg.target_group_id,
+                "message": msg.message,
+                "scheduled_timestamp": _naive_utc(msg.scheduled_timestamp),
+                "file_paths": None,
+                "recurrence": msg.recurrence,
+                "recurrence_start": _naive_utc(msg.scheduled_timestamp) if msg.recurrence else None,
+                "is_sent": False,
+                "created_at": now
+            }
+            for msg in messages
+        ]
+        for start in range(0, len(rows), STATEMENT_CHUNK_SIZE):
+            await db.execute(insert(ScheduledMessage), rows[start:start + STATEMENT_CHUNK_SIZE])
+        await db.commit()
+
+        notify_messages_scheduled([(row["id"], row["scheduled_timestamp"]) for row in rows])
+
+        return {"ids": [row["id"] for row in rows], "count": len(rows)}
 
-    except HTTPException:
-        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/pending-messages", response_model=List[ScheduleMessageResponse])
-async def get_pending_messages(from_sender: str = Query(..., alias="from_sender"), db: Session = Depends(get_db)):
+@app.post("/groups", response_model=GroupResponse)
+async def create_group(group_data: GroupCreateRequest, db: AsyncSession = Depends(get_db)):
     """
-    Get all messages that are pending and match the 'from' sender property.
+    Create a named audience group, optionally with its first members.
+
+    Messages can then target the group with **target_group_id**; its
+    members are expanded into recipients only when the message is delivered.
     """
     try:
-        # We query the database for unsent messages matching the 'from' criteria
-        pending_messages = db.query(ScheduledMessage).filter(
-            ScheduledMessage.from_sender == from_sender  # Ensure this matches your model field name
-        ).all()
-
-        return pending_messages
+        group = AudienceGroup(group_id=str(uuid.uuid4()), name=group_data.name)
+        db.add(group)
+        added = await _add_group_members(db, group.group_id, group_data.user_ids)
+        await db.commit()
+        await db.refresh(group)
+        return {"group_id": group.group_id, "name": group.name, "member_count": added, "created_at": group.created_at}
 
     except Exception as e:
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.delete("/delete-message", response_model=bool)
-async def delete_scheduled_message(message_id: str = Query(...), db: Session = Depends(get_db)):
-    try:
-        msg = (
-            db.query(ScheduledMessage)
-            .filter(ScheduledMessage.id == message_id)
-            .first()
-        )
-        if not msg:
-            raise HTTPException(status_code=404, detail="Message not found")
-
-        db.delete(msg)
-        db.commit()
-        return True
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/subscribed-users", response_model=List[SubscribeUserResponse])
-async def get_subscribed_users(db: Session = Depends(get_db)):
-    """
-    Get all subscribed users.
-    """
+@app.get("/groups", response_model=List[GroupResponse])
+async def get_groups(db: AsyncSession = Depends(get_db)):
+    """Get all audience groups with their member counts"""
     try:
-        users = db.query(SubscribedUser).all()
-        return users
+        result = await db.execute(
+            select(AudienceGroup, func.count(AudienceGroupMember.user_id))
+            .outerjoin(AudienceGroupMember, AudienceGroupMember.group_id == AudienceGroup.group_id)
+            .group_by(AudienceGroup.group_id)
+            .order_by(AudienceGroup.created_at)
+        )
+        return [
+            {"group_id": group.group_id, "name": group.name, "member_count": count, "created_at": group.created_at}
+            for group, count in result.all()
+        ]
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/")
-async def root():
-    """Root endpoint with API information"""
-    return {
-        "message": "Scheduled Message API",
-        "version": "1.0.0",
-        "endpoints": {
-            "POST /schedule-message": "Schedule a new message",
-            "POST /subscribe-user": "Subscribe a new user",
-            "GET /pending-messages": "Get all pending messages",
-            "GET /subscribed-users": "Get all subscribed users"
-        },
-        "docs": "/docs",
-        "redoc": "/redoc"
-    }
-
-
-def create_app():
-    """Factory function to create and configure the FastAPI application"""
-    return app
-"""
-FastAPI application - REST API endpoints for scheduled message system.
-"""
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, status, Query
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from datetime import datetime
-import uuid
-import os
-from dotenv import load_dotenv
-import shutil
-from pathlib import Path
-
-from database import get_db, init_db
-from models import ScheduledMessage, SubscribedUser
-from schemas import (
-    ScheduleMessageRequest,
-    ScheduleMessageResponse,
-    SubscribeUserRequest,
-    SubscribeUserResponse
-)
-from scheduler import start_message_scheduler
-
-# Load environment variables
-load_dotenv()
-
-# Create FastAPI application
-app = FastAPI(
-    title="Scheduled Message API",
-    description="API for scheduling messages with file attachments and Telegram delivery",
-    version="1.0.0"
-)
-
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-
-# Mount static files to serve uploaded files
-app.mount("/files", StaticFiles(directory="uploads"), name="files")
+@app.get("/groups/{group_id}/members", response_model=List[str])
+async def get_group_members(
+        group_id: str,
+        response: Response,
+        cursor: Optional[str] = Query(None),
+        limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+        db: AsyncSession = Depends(get_db)
+):
+    """Get a page of a group's member user_ids; follow `X-Next-Cursor` for the next page"""
+    try:
+        if not await db.get(AudienceGroup, group_id):
+            raise HTTPException(status_code=404, detail="Group not found")
 
-# Base URL for file access
-BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
+        query = select(AudienceGroupMember.user_id).where(
+            AudienceGroupMember.group_id == group_id
+        ).order_by(AudienceGroupMember.user_id).limit(limit)
+        if cursor:
+            (after_id,) = _decode_cursor(cursor, str)
+            query = query.where(AudienceGroupMember.user_id > after_id)
+        user_ids = (await db.scalars(query)).all()
 
+        if len(user_ids) == limit:
+            response.headers["X-Next-Cursor"] = _encode_cursor(user_ids[-1])
+        return user_ids
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database and start background tasks on startup"""
-    init_db()
-    start_message_scheduler(app)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/schedule-message", response_model=ScheduleMessageResponse)
-async def schedule_message(
-        from_sender: str = Form(...),
-        target_user_id: str = Form(...),
-        message: str = Form(...),
-        scheduled_timestamp: str = Form(...),
-        files: Optional[List[UploadFile]] = File(None),
-        db: Session = Depends(get_db)
-):
-    """
-    Schedule a message to be sent at a specific time.
-    - **from_sender**: sender IDs that sent message
-    - **target_user_id**: Comma-separated list of user IDs
-    - **message**: The message content
-    - **scheduled_timestamp**: UTC timestamp (ISO 8601 format)
-    - **files**: Optional list of files to attach
-    """
+@app.post("/groups/{group_id}/members", response_model=int)
+async def add_group_members(group_id: str, members: GroupMembersRequest, db: AsyncSession = Depends(get_db)):
+    """Add users to a group; returns how many were not members yet"""
     try:
-        # Parse target_user_id (comma-separated string to list)
-        target_users = [uid.strip() for uid in target_user_id.split(",")]
+        if not await db.get(AudienceGroup, group_id):
+            raise HTTPException(status_code=404, detail="Group not found")
 
-        # Parse scheduled timestamp
-        scheduled_dt = datetime.fromisoformat(scheduled_timestamp.replace('Z', '+00:00'))
+        added = await _add_group_members(db, group_id, members.user_ids)
+        await db.commit()
+        return added
 
-        # Generate unique ID for this scheduled message
-        message_id = str(uuid.uuid4())
-
-        # Handle file uploads
-        file_paths = []
-        if files:
-            for file in files:
-                if file.filename:
-                    # Generate unique filename
-                    file_extension = Path(file.filename).suffix
-                    unique_filename = f"{message_id}_{uuid.uuid4()}{file_extension}"
-                    file_path = UPLOAD_DIR / unique_filename
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
 
-                    # Save file
-                    with open(file_path, "wb") as buffer:
-                        shutil.copyfileobj(file.file, buffer)
 
-                    file_paths.append(str(file_path))
+@app.delete("/groups/{group_id}/members", response_model=int)
+async def remove_group_members(group_id: str, members: GroupMembersRequest, db: AsyncSession = Depends(get_db)):
+    """Remove users from a group; returns how many were removed"""
+    try:
+        removed = 0
+        user_ids = list(dict.fromkeys(members.user_ids))
+        for start in range(0, len(user_ids), STATEMENT_CHUNK_SIZE):
+            result = await db.execute(delete(AudienceGroupMember).where(
+                AudienceGroupMember.group_id == group_id,
+                AudienceGroupMember.user_id.in_(user_ids[start:start + STATEMENT_CHUNK_SIZE])
+            ).execution_options(synchronize_session=False))
+            removed += result.rowcount
+        await db.commit()
+        return removed
 
-        # Create scheduled message record
-        scheduled_msg = ScheduledMessage(
-            id=message_id,
-            from_sender=from_sender,
-            target_user_id=target_users,
-            message=message,
-            scheduled_timestamp=scheduled_dt,
-            file_paths=file_paths if file_paths else None,
-            is_sent=False
-        )
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
 
-        db.add(scheduled_msg)
-        db.commit()
-        db.refresh(scheduled_msg)
 
-        return scheduled_msg
+@app.delete("/groups/{group_id}", response_model=bool)
+async def delete_group(group_id: str, db: AsyncSession = Depends(get_db)):
+    """Delete a group and its memberships; refused while unsent messages target it"""
+    try:
+        group = await db.get(AudienceGroup, group_id)
+        if not group:
+            raise HTTPException(status_code=404, detail="Group not found")
+
+        in_use = await db.scalar(select(ScheduledMessage.id).where(
+            ScheduledMessage.target_group_id == group_id,
+            ScheduledMessage.is_sent == False
+        ).limit(1))
+        if in_use:
+            raise HTTPException(status_code=409, detail="Group is targeted by unsent messages")
+
+        await db.execute(delete(AudienceGroupMember).where(
+            AudienceGroupMember.group_id == group_id
+        ).execution_options(synchronize_session=False))
+        await db.delete(group)
+        await db.commit()
+        return True
 
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=f"Invalid timestamp format: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/subscribe-user", response_model=SubscribeUserResponse)
+async def _add_group_members(db: AsyncSession, group_id: str, user_ids: List[str]) -> int:
+    """Insert the memberships that don't exist yet (the caller commits)"""
+    user_ids = list(dict.fromkeys(user_ids))
+    added = 0
+    for start in range(0, len(user_ids), STATEMENT_CHUNK_SIZE):
+        chunk = user_ids[start:start + STATEMENT_CHUNK_SIZE]
+        existing = set((await db.scalars(select(AudienceGroupMember.user_id).where(
+            AudienceGroupMember.group_id == group_id,
+            AudienceGroupMember.user_id.in_(chunk)
+        ))).all())
+        new_members = [{"group_id": group_id, "user_id": user_id} for user_id in chunk if user_id not in existing]
+        if new_members:
+            await db.execute(insert(AudienceGroupMember), new_members)
+            added += len(new_members)
+    return added
+
+
+@app.post("/subscribe-user", response_model=SubscribeUserResult)
 async def subscribe_user(
         user_data: SubscribeUserRequest,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
     """
-    Subscribe a new user and generate a unique user_id.
+    Subscribe a user, or return the existing subscription for the chat.
 
     - **chat_id**: Unique chat identifier
     - **chat_name**: Name of the chat/user
+
+    A single INSERT ... ON CONFLICT statement either creates the user with
+    a new user_id or refreshes the chat_name of the existing one, so
+    concurrent /start requests for the same chat cannot race. **created**
+    tells the two cases apart.
     """
     try:
-        # Check if chat_id already exists
-        existing_user = db.query(SubscribedUser).filter(
-            SubscribedUser.chat_id == user_data.chat_id
-        ).first()
-
-        if existing_user:
-            raise HTTPException(
-                status_code=400,
-                detail=f"User with chat_id {user_data.chat_id} already exists"
-            )
-
         # Generate random user_id
         user_id = str(uuid.uuid4())
 
-        # Create new subscribed user
-        new_user = SubscribedUser(
+        statement = upsert_insert(db, SubscribedUser).values(
             user_id=user_id,
             chat_id=user_data.chat_id,
-            chat_name=user_data.chat_name
+            chat_name=user_data.chat_name,
+            created_at=datetime.utcnow()
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[SubscribedUser.chat_id],
+            set_={"chat_name": statement.excluded.chat_name}
+        ).returning(
+            SubscribedUser.user_id,
+            SubscribedUser.chat_id,
+            SubscribedUser.chat_name,
+            SubscribedUser.created_at
         )
+        user = (await db.execute(statement)).one()
+        await db.commit()
+
+        # Keep the delivery lookup cache coherent with the new subscription
+        subscriber_cache.put(user.user_id, user.chat_id)
 
-        db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        return {**user._asdict(), "created": user.user_id == user_id}
 
-        return new_user
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/subscribed-users/import", response_model=SubscriberImportResponse)
+async def import_subscribers(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Import existing chats as subscribers.
+
+    The body is a JSON array of `{"chat_id", "chat_name"}` objects, or one
+    object per line with `Content-Type: application/x-ndjson`. NDJSON is
+    read as it arrives, so large imports don't have to fit in memory.
+    Rows are inserted and committed in chunks of SUBSCRIBER_IMPORT_CHUNK_SIZE;
+    chats that are already subscribed are skipped.
+    """
+    received = 0
+    imported = 0
+    chunk = []
+
+    async def flush():
+        nonlocal imported
+        rows = list({row["chat_id"]: row for row in chunk}.values())
+        chunk.clear()
+        if not rows:
+            return
+        existing = set((await db.scalars(select(SubscribedUser.chat_id).where(
+            SubscribedUser.chat_id.in_([row["chat_id"] for row in rows])
+        ))).all())
+        new_rows = [row for row in rows if row["chat_id"] not in existing]
+        if new_rows:
+            # ON CONFLICT covers chats subscribed concurrently since the lookup
+            now = datetime.utcnow()
+            await db.execute(
+                upsert_insert(db, SubscribedUser).on_conflict_do_nothing(index_elements=[SubscribedUser.chat_id]),
+                [
+                    {"user_id": str(uuid.uuid4()), "chat_id": row["chat_id"], "chat_name": row["chat_name"], "created_at": now}
+                    for row in new_rows
+                ]
+            )
+        await db.commit()
+        imported += len(new_rows)
+
+    try:
+        async for spec in _read_json_records(request):
+            received += 1
+            try:
+                chunk.append(SubscribeUserRequest.model_validate(spec).model_dump())
+            except ValidationError as e:
+                raise HTTPException(
+                    status_code=422,
+                    detail={"index": received - 1, "errors": e.errors(include_url=False, include_context=False),
+                            "imported": imported}
+                )
+            if len(chunk) >= SUBSCRIBER_IMPORT_CHUNK_SIZE:
+                await flush()
+        await flush()
+
+        return {"received": received, "imported": imported, "existing": received - imported}
 
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _read_json_records(request: Request):
+    """Yield the records of a JSON array body, or of an NDJSON body as it streams in"""
+    if "ndjson" not in request.headers.get("content-type", ""):
+        try:
+            records = json.loads(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
+        if not isinstance(records, list):
+            raise HTTPException(status_code=400, detail="Expected an array")
+        for record in records:
+            yield record
+        return
+
+    buffer = b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_json_line(line)
+    if buffer.strip():
+        yield _parse_json_line(buffer)
+
+
+def _parse_json_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON line: {str(e)}")
+
+
 @app.get("/pending-messages", response_model=List[ScheduleMessageResponse])
-async def get_pending_messages(from_sender: str = Query(..., alias="from_sender"), db: Session = Depends(get_db)):
+async def get_pending_messages(
+        request: Request,
+        response: Response,
+        from_sender: str = Query(..., alias="from_sender"),
+        is_sent: Optional[bool] = Query(None),
+        scheduled_after: Optional[datetime] = Query(None),
+        scheduled_before: Optional[datetime] = Query(None),
+        cursor: Optional[str] = Query(None),
+        limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+        db: AsyncSession = Depends(get_db)
+):
     """
-    Get all messages that are pending and match the 'from' sender property.
+    Get the messages scheduled by a sender, ordered by scheduled time.
+
+    - **is_sent**: Only sent (`true`) or only unsent (`false`) messages
+    - **scheduled_after** / **scheduled_before**: Scheduled time range (inclusive / exclusive)
+    - **cursor**: Value of the `X-Next-Cursor` header of the previous page
+    - **limit**: Page size
+
+    Each page carries an ETag; a request whose If-None-Match still matches
+    gets 304 Not Modified without the page being loaded or serialized.
     """
     try:
-        # We query the database for unsent messages matching the 'from' criteria
-        pending_messages = db.query(ScheduledMessage).filter(
-            ScheduledMessage.from_sender == from_sender  # Ensure this matches your model field name
-        ).all()
+        query = select(ScheduledMessage.id, ScheduledMessage.is_sent, ScheduledMessage.scheduled_timestamp).where(
+            ScheduledMessage.from_sender == from_sender
+        )
+        if is_sent is not None:
+            query = query.where(ScheduledMessage.is_sent == is_sent)
+        if scheduled_after is not None:
+            query = query.where(ScheduledMessage.scheduled_timestamp >= _naive_utc(scheduled_after))
+        if scheduled_before is not None:
+            query = query.where(ScheduledMessage.scheduled_timestamp < _naive_utc(scheduled_before))
+        if cursor:
+            after_timestamp, after_id = _decode_cursor(cursor, datetime, str)
+            query = query.where(
+                tuple_(ScheduledMessage.scheduled_timestamp, ScheduledMessage.id)
+                > tuple_(after_timestamp, after_id)
+            )
+        query = query.order_by(ScheduledMessage.scheduled_timestamp, ScheduledMessage.id).limit(limit)
+
+        # Messages never change after scheduling except for is_sent and the
+        # next occurrence of recurring ones, so these columns identify the page
+        page = (await db.execute(query)).all()
+        etag = _etag(request.url.query, page)
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+        by_id = {msg.id: msg for msg in (await db.scalars(select(ScheduledMessage).where(
+            ScheduledMessage.id.in_([row.id for row in page])
+        ))).all()}
+        pending_messages = [by_id[row.id] for row in page if row.id in by_id]
+
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        if len(page) == limit and pending_messages:
+            last = pending_messages[-1]
+            response.headers["X-Next-Cursor"] = _encode_cursor(last.scheduled_timestamp.isoformat(), last.id)
 
         return pending_messages
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+def _naive_utc(value: datetime) -> datetime:
+    """Timestamps are stored as naive UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _encode_cursor(*values: str) -> str:
+    """Opaque keyset cursor for the position after the given sort key"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor: str, *types: type) -> list:
+    """
+    Sort key encoded in a cursor, one value per entry of `types`.
+
+    Values are strings in the cursor; datetime entries are parsed from ISO
+    8601. Anything that doesn't decode to that shape is a 400.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(types) or not all(isinstance(v, str) for v in values):
+            raise ValueError("Unexpected cursor shape")
+        return [datetime.fromisoformat(v) if t is datetime else v for v, t in zip(values, types)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _etag(query: str, rows) -> str:
+    """Weak validator over the request and the state of the rows it returns"""
+    digest = hashlib.sha1(query.encode())
+    for row in rows:
+        digest.update(repr(tuple(row)).encode())
+    return f'W/"{digest.hexdigest()}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already names this ETag"""
+    tags = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    return "*" in tags or etag in tags
+
 @app.delete("/delete-message", response_model=bool)
-async def delete_scheduled_message(message_id: str = Query(...), db: Session = Depends(get_db)):
+async def delete_scheduled_message(message_id: str = Query(...), db: AsyncSession = Depends(get_db)):
     try:
-        msg = (
-            db.query(ScheduledMessage)
-            .filter(ScheduledMessage.id == message_id)
-            .first()
-        )
+        msg = await db.get(ScheduledMessage, message_id)
         if not msg:
             raise HTTPException(status_code=404, detail="Message not found")
 
-        db.delete(msg)
-        db.commit()
+        await db.delete(msg)
+        await delete_deliveries(db, message_id)
+        unreferenced = await release_references(db, msg.file_paths or [])
+        await db.commit()
+
+        notify_message_deleted(message_id)
+
+        # Files no other message attaches are removed from disk
+        await remove_unreferenced(db, unreferenced)
         return True
 
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/subscribed-users", response_model=List[SubscribeUserResponse])
-async def get_subscribed_users(db: Session = Depends(get_db)):
+async def get_subscribed_users(
+        request: Request,
+        response: Response,
+        format: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+        cursor: Optional[str] = Query(None),
+        limit: Optional[int] = Query(None, ge=1, le=PAGE_SIZE_MAX),
+        db: AsyncSession = Depends(get_db)
+):
     """
-    Get all subscribed users.
+    Get subscribed users, ordered by user_id.
+
+    - **limit** / **cursor**: Return one page; the `X-Next-Cursor` header
+      of a page is the cursor of the next one
+    - **format=ndjson** (or `Accept: application/x-ndjson`): Stream every
+      user as newline-delimited JSON
+
+    Without limit or cursor the whole list is streamed as a JSON array, so
+    neither mode holds the table in memory.
     """
     try:
-        users = db.query(SubscribedUser).all()
+        if limit is None and cursor is None:
+            ndjson = format == "ndjson" or (
+                format is None and "application/x-ndjson" in request.headers.get("accept", "")
+            )
+            if ndjson:
+                return StreamingResponse(_stream_subscribed_users(ndjson=True), media_type="application/x-ndjson")
+            return StreamingResponse(_stream_subscribed_users(ndjson=False), media_type="application/json")
+
+        limit = limit or PAGE_SIZE_DEFAULT
+        query = select(SubscribedUser).order_by(SubscribedUser.user_id).limit(limit)
+        if cursor:
+            (after_id,) = _decode_cursor(cursor, str)
+            query = query.where(SubscribedUser.user_id > after_id)
+        users = (await db.scalars(query)).all()
+
+        if len(users) == limit:
+            response.headers["X-Next-Cursor"] = _encode_cursor(users[-1].user_id)
         return users
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _stream_subscribed_users(ndjson: bool):
+    """
+    Yield all subscribed users from a server-side cursor, one chunk of rows at a time.
+
+    Uses its own session, since the response body is produced after the
+    endpoint (and its request session) has returned.
+    """
+    separator = "\n" if ndjson else ","
+    first = True
+    if not ndjson:
+        yield "["
+    async with SessionLocal() as db:
+        result = await db.stream_scalars(
+            select(SubscribedUser)
+            .order_by(SubscribedUser.user_id)
+            .execution_options(yield_per=STREAM_CHUNK_SIZE)
+        )
+        async for users in result.partitions():
+            lines = [SubscribeUserResponse.model_validate(user).model_dump_json() for user in users]
+            chunk = separator.join(lines)
+            if ndjson:
+                chunk += "\n"
+            elif not first:
+                chunk = "," + chunk
+            first = False
+            yield chunk
+    if not ndjson:
+        yield "]"
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/db-stats")
+async def db_stats():
+    """Database connection pool statistics"""
+    return get_pool_stats()
+
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -456,9 +867,15 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "POST /schedule-message": "Schedule a new message",
-            "POST /subscribe-user": "Subscribe a new user",
-            "GET /pending-messages": "Get all pending messages",
-            "GET /subscribed-users": "Get all subscribed users"
+            "POST /schedule-messages": "Schedule a batch of messages (JSON array or NDJSON)",
+            "POST /subscribe-user": "Subscribe a user (returns the existing one for a known chat)",
+            "POST /subscribed-users/import": "Import subscribers in bulk (JSON array or NDJSON)",
+            "POST /groups": "Create an audience group",
+            "GET /groups": "List audience groups",
+            "GET /pending-messages": "Get a sender's messages, one page at a time",
+            "GET /subscribed-users": "Get subscribed users (paged, or streamed as JSON / NDJSON)",
+            "GET /db-stats": "Database connection pool statistics",
+            "GET /metrics": "Prometheus metrics"
         },
         "docs": "/docs",
         "redoc": "/redoc"
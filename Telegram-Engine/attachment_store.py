@@ -0,0 +1,329 @@
+"""
+Attachment store - Content-addressed, reference-counted storage for uploads.
+
+Every uploaded file is stored once under its SHA-256, as
+uploads/{hash}{ext}. The attachments table keeps one row per stored file
+with the number of scheduled messages that reference it. Scheduling a
+message adds a reference to each of its files; deleting the message
+releases them, and a file is removed from disk together with its row once
+nothing references it anymore.
+
+Because the path depends only on the bytes, the Telegram file_id recorded
+for a file is reused by every later message that attaches the same file.
+"""
+import hashlib
+import logging
+import os
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from fastapi import Request
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from database import upsert_insert
+from models import Attachment
+
+logger = logging.getLogger(__name__)
+
+# Stored files, served under /files
+UPLOAD_DIR = Path("uploads")
+# Uploads being received; moved into UPLOAD_DIR once their hash is known
+INCOMING_DIR = UPLOAD_DIR / ".incoming"
+
+# Upload limits, enforced while the request body is streamed to disk
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", str(50 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(200 * 1024 * 1024)))
+# Combined size of a form's non-file fields
+MAX_FORM_FIELD_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload goes over the per-file or per-request limit"""
+
+
+def init_store() -> None:
+    """Create the storage directories"""
+    INCOMING_DIR.mkdir(parents=True, exist_ok=True)
+
+
+class InvalidForm(Exception):
+    """Raised when a request body is not a well-formed form"""
+
+
+class ReceivedFile:
+    """An upload written to the incoming directory, with its hash and size"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.incoming_path = INCOMING_DIR / f"{uuid.uuid4()}.part"
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._buffer = None
+
+    @property
+    def content_hash(self) -> str:
+        return self._digest.hexdigest()
+
+
+def _write_parts(writes: List[Tuple[ReceivedFile, bytes]], finished: List[ReceivedFile]) -> None:
+    for received, data in writes:
+        if received._buffer is None:
+            received._buffer = open(received.incoming_path, "wb")
+        received._buffer.write(data)
+    for received in finished:
+        if received._buffer is None:
+            # Empty file: no data callback ever opened it
+            received._buffer = open(received.incoming_path, "wb")
+        received._buffer.close()
+
+
+def _discard_files(files: List[ReceivedFile]) -> None:
+    for received in files:
+        if received._buffer is not None:
+            received._buffer.close()
+        received.incoming_path.unlink(missing_ok=True)
+
+
+class _FormReceiver:
+    """
+    Callbacks for python-multipart's streaming parser.
+
+    File data is hashed and checked against the limits as soon as the parser
+    sees it, and queued for writing; receive_form() writes the queue in the
+    threadpool after every chunk of the request body.
+    """
+
+    def __init__(self, file_field: str, charset: str):
+        self.file_field = file_field
+        self.charset = charset
+        self.fields: Dict[str, str] = {}
+        self.files: List[ReceivedFile] = []
+        self.writes: List[Tuple[ReceivedFile, bytes]] = []
+        self.finished: List[ReceivedFile] = []
+        self.request_bytes = 0
+        self.field_bytes = 0
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._name = ""
+        self._data = bytearray()
+        self._file: Optional[ReceivedFile] = None
+        self._skip = False
+
+    def on_part_begin(self) -> None:
+        self._disposition = b""
+        self._data = bytearray()
+        self._file = None
+        self._skip = False
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise InvalidForm("Every form part needs a name")
+        self._name = options[b"name"].decode(self.charset, errors="replace")
+        if b"filename" in options:
+            filename = options[b"filename"].decode(self.charset, errors="replace")
+            # Browsers send an empty part for a file input left blank; other
+            # file fields aren't part of the API
+            if not filename or self._name != self.file_field:
+                self._skip = True
+                return
+            self._file = ReceivedFile(filename)
+            self.files.append(self._file)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._skip:
+            return
+        chunk = data[start:end]
+        if self._file is None:
+            self.field_bytes += len(chunk)
+            if self.field_bytes > MAX_FORM_FIELD_BYTES:
+                raise UploadTooLarge(f"Form fields exceed {MAX_FORM_FIELD_BYTES} bytes")
+            self._data.extend(chunk)
+            return
+
+        self._file.size += len(chunk)
+        self.request_bytes += len(chunk)
+        if self._file.size > MAX_UPLOAD_FILE_BYTES or self.request_bytes > MAX_UPLOAD_REQUEST_BYTES:
+            raise UploadTooLarge(
+                f"{self._file.filename} exceeds the upload limit "
+                f"({MAX_UPLOAD_FILE_BYTES} bytes per file, {MAX_UPLOAD_REQUEST_BYTES} per request)"
+            )
+        self._file._digest.update(chunk)
+        self.writes.append((self._file, chunk))
+
+    def on_part_end(self) -> None:
+        if self._skip:
+            return
+        if self._file is None:
+            self.fields[self._name] = self._data.decode(self.charset, errors="replace")
+        else:
+            self.finished.append(self._file)
+
+
+async def receive_form(request: Request, file_field: str = "files") -> Tuple[Dict[str, str], List[ReceivedFile]]:
+    """
+    Parse a form body while it streams in, writing uploads straight to disk.
+
+    multipart/form-data parts named `file_field` are hashed and written to
+    the incoming directory chunk by chunk, off the event loop. The upload
+    limits are checked as the bytes arrive, so an oversized or endless
+    (chunked) upload is rejected with UploadTooLarge after at most one chunk
+    over the limit, and everything received so far is removed. Other fields
+    are returned as strings. A malformed body raises InvalidForm.
+
+    Returns (fields, received files).
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    charset = params.get(b"charset", b"utf-8").decode("latin-1")
+
+    if content_type == b"application/x-www-form-urlencoded":
+        body = bytearray()
+        async for chunk in request.stream():
+            body.extend(chunk)
+            if len(body) > MAX_FORM_FIELD_BYTES:
+                raise UploadTooLarge(f"Form fields exceed {MAX_FORM_FIELD_BYTES} bytes")
+        return dict(parse_qsl(body.decode(charset, errors="replace"), keep_blank_values=True)), []
+
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise InvalidForm("Expected a multipart/form-data or application/x-www-form-urlencoded body")
+
+    receiver = _FormReceiver(file_field, charset)
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": receiver.on_part_begin,
+        "on_part_data": receiver.on_part_data,
+        "on_part_end": receiver.on_part_end,
+        "on_header_field": receiver.on_header_field,
+        "on_header_value": receiver.on_header_value,
+        "on_header_end": receiver.on_header_end,
+        "on_headers_finished": receiver.on_headers_finished,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if receiver.writes or receiver.finished:
+                await run_in_threadpool(_write_parts, receiver.writes, receiver.finished)
+                receiver.writes = []
+                receiver.finished = []
+        parser.finalize()
+        if receiver.writes or receiver.finished:
+            await run_in_threadpool(_write_parts, receiver.writes, receiver.finished)
+    except FormParserError as e:
+        await run_in_threadpool(_discard_files, receiver.files)
+        raise InvalidForm(f"Invalid multipart body: {str(e)}")
+    except BaseException:
+        await run_in_threadpool(_discard_files, receiver.files)
+        raise
+    return receiver.fields, receiver.files
+
+
+def stored_path(content_hash: str, filename: str) -> str:
+    """Where a file with this content is kept"""
+    return str(UPLOAD_DIR / f"{content_hash}{Path(filename).suffix.lower()}")
+
+
+async def add_references(db: AsyncSession, files: Dict[str, Tuple[str, int]], file_paths: List[str]) -> None:
+    """
+    Count one reference per entry in file_paths, creating rows for new files.
+
+    files maps each stored path to its (content hash, size). Nothing is
+    committed here; the caller commits together with the message. A single
+    upsert per file, so concurrent uploads of the same new file both count
+    instead of racing to insert its row.
+    """
+    for file_path, count in Counter(file_paths).items():
+        content_hash, size = files[file_path]
+        await db.execute(
+            upsert_insert(db, Attachment).values(
+                file_path=file_path,
+                content_hash=content_hash,
+                size_bytes=size,
+                ref_count=count
+            ).on_conflict_do_update(
+                index_elements=[Attachment.file_path],
+                set_={"ref_count": Attachment.ref_count + count}
+            ).execution_options(synchronize_session=False)
+        )
+
+
+async def commit_files(incoming: Dict[str, Path]) -> None:
+    """
+    Move received uploads to their stored paths.
+
+    Runs after the references are committed, so a file that a concurrent
+    release just removed is put back. Identical content may already be
+    there; replacing it is a rename of the same bytes.
+    """
+    for file_path, incoming_path in incoming.items():
+        await run_in_threadpool(os.replace, incoming_path, file_path)
+
+
+def discard_incoming(incoming: Dict[str, Path]) -> None:
+    """Delete received uploads of a request that was rejected"""
+    for incoming_path in incoming.values():
+        incoming_path.unlink(missing_ok=True)
+
+
+async def release_references(db: AsyncSession, file_paths: List[str]) -> List[str]:
+    """
+    Drop one reference per entry in file_paths.
+
+    Rows that reach zero are deleted and their paths returned, to be removed
+    with remove_unreferenced() once the caller has committed.
+    """
+    counts = Counter(file_paths)
+    for file_path, count in counts.items():
+        await db.execute(
+            update(Attachment)
+            .where(Attachment.file_path == file_path)
+            .values(ref_count=Attachment.ref_count - count)
+            .execution_options(synchronize_session=False)
+        )
+
+    unreferenced = list((await db.scalars(select(Attachment.file_path).where(
+        Attachment.file_path.in_(list(counts)),
+        Attachment.ref_count <= 0
+    ))).all())
+    if unreferenced:
+        await db.execute(
+            delete(Attachment)
+            .where(Attachment.file_path.in_(unreferenced))
+            .execution_options(synchronize_session=False)
+        )
+    return unreferenced
+
+
+async def remove_unreferenced(db: AsyncSession, file_paths: List[str]) -> None:
+    """Delete released files from disk unless a new reference appeared meanwhile"""
+    if not file_paths:
+        return
+    referenced = set((await db.scalars(select(Attachment.file_path).where(
+        Attachment.file_path.in_(file_paths)
+    ))).all())
+    for file_path in file_paths:
+        if file_path in referenced:
+            continue
+        try:
+            await run_in_threadpool(Path(file_path).unlink, True)
+            logger.info(f"Removed unreferenced attachment {file_path}")
+        except OSError as e:
+            logger.error(f"Error removing attachment {file_path}: {str(e)}")
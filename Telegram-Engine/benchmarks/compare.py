@@ -0,0 +1,87 @@
+"""
+Compare benchmark reports - Metric-by-metric delta between two runs of a suite.
+
+Prints a Markdown table (ready to paste into a pull request) of every metric
+present in both reports, with the relative change. Changes beyond
+--threshold percent are marked; the exit status is 1 if any of them is a
+regression, so the comparison can gate CI.
+
+Whether higher is better is inferred from the metric name: throughputs
+("per_second", "ops") and delivery counts are better higher, everything
+else (latencies, lateness, durations, errors) is better lower.
+
+Run with: python benchmarks/compare.py results/load_test-abc1234.json results/load_test-def5678.json
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+HIGHER_IS_BETTER = ("per_second", "ops", "delivered")
+# Metrics that describe the run rather than measure it
+DESCRIPTIVE = ("recipients", "messages", "expected_deliveries", "requests", "rounds", "size")
+# Counts of randomly injected faults
+INJECTED = "injected_"
+
+
+def _higher_is_better(metric: str) -> bool:
+    return any(marker in metric for marker in HIGHER_IS_BETTER)
+
+
+def _change(old: float, new: float) -> Optional[float]:
+    if old == 0:
+        return None
+    return (new - old) / abs(old) * 100
+
+
+def compare(base: dict, head: dict, threshold: float) -> Tuple[List[str], bool]:
+    """Markdown table lines and whether any metric regressed beyond the threshold"""
+    lines = [
+        f"**{head['suite']}**: `{base['commit']}` → `{head['commit']}`",
+        "",
+        "| Scenario | Metric | Base | Head | Change |",
+        "|----------|--------|-----:|-----:|-------:|",
+    ]
+    regressed = False
+    for scenario, head_metrics in head["results"].items():
+        base_metrics = base["results"].get(scenario)
+        if base_metrics is None:
+            continue
+        for metric, new in head_metrics.items():
+            old = base_metrics.get(metric)
+            if not isinstance(new, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            if metric.endswith(DESCRIPTIVE) or metric.startswith(INJECTED):
+                continue
+            change = _change(old, new)
+            marker = ""
+            if change is not None and abs(change) >= threshold:
+                better = (change > 0) == _higher_is_better(metric)
+                marker = " ✅" if better else " ❌"
+                regressed = regressed or not better
+            change_text = "n/a" if change is None else f"{change:+.1f}%"
+            lines.append(f"| {scenario} | {metric} | {old:.4g} | {new:.4g} | {change_text}{marker} |")
+    return lines, regressed
+
+
+def main() -> None:
+    """Print the comparison of two reports"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base", type=Path, help="Report of the baseline, e.g. the target branch")
+    parser.add_argument("head", type=Path, help="Report of the change under review")
+    parser.add_argument("--threshold", type=float, default=10, help="Percent change that counts as significant")
+    args = parser.parse_args()
+
+    base = json.loads(args.base.read_text())
+    head = json.loads(args.head.read_text())
+    if base["suite"] != head["suite"]:
+        sys.exit(f"Cannot compare a {base['suite']} report with a {head['suite']} report")
+
+    lines, regressed = compare(base, head, args.threshold)
+    print("\n".join(lines))
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
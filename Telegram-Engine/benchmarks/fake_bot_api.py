@@ -0,0 +1,167 @@
+"""
+Fake Telegram Bot API - Local stand-in for api.telegram.org used by the load test.
+
+Answers sendMessage, sendDocument and the handful of other methods the
+engine calls, after a configurable delay, and injects 429 Too Many Requests,
+permanent 400 errors and transient 502 errors at configurable rates.
+
+Messages whose text ends with "@<unix timestamp>" are treated as benchmark
+messages: for each successful delivery the server records how late it
+arrived relative to that timestamp. GET /stats returns the counters and
+lateness samples, POST /stats/reset clears them.
+
+Point the engine at it with TELEGRAM_API_BASE_URL=http://127.0.0.1:<port>/bot
+Run with: python benchmarks/fake_bot_api.py --port 8081 --latency-ms 50 --rate-limit-rate 0.01
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake Telegram Bot API")
+
+
+class Behaviour:
+    """How the fake server answers; set from the command line"""
+    latency_ms = 0.0
+    latency_jitter_ms = 0.0
+    rate_limit_rate = 0.0
+    retry_after_seconds = 1
+    error_rate = 0.0
+    server_error_rate = 0.0
+
+
+class Stats:
+    """Counters and lateness samples since the last reset"""
+
+    def __init__(self):
+        self.requests = 0
+        self.delivered = 0
+        self.documents = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.server_errors = 0
+        self.first_delivery_at: Optional[float] = None
+        self.last_delivery_at: Optional[float] = None
+        self.lateness: List[float] = []
+
+    def record_delivery(self, text: str) -> None:
+        now = time.time()
+        self.delivered += 1
+        if self.first_delivery_at is None:
+            self.first_delivery_at = now
+        self.last_delivery_at = now
+        _, _, scheduled_at = text.rpartition("@")
+        try:
+            self.lateness.append(now - float(scheduled_at))
+        except ValueError:
+            pass
+
+
+stats = Stats()
+_message_ids = iter(range(1, 2 ** 62))
+
+
+def _error(status_code: int, description: str, **parameters) -> JSONResponse:
+    content = {"ok": False, "error_code": status_code, "description": description}
+    if parameters:
+        content["parameters"] = parameters
+    return JSONResponse(status_code=status_code, content=content)
+
+
+def _message(chat_id: str, **fields) -> dict:
+    return {
+        "ok": True,
+        "result": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            **fields
+        }
+    }
+
+
+@app.post("/bot{token}/{method}")
+async def bot_method(token: str, method: str, request: Request):
+    """Answer one Bot API call the way Telegram would"""
+    stats.requests += 1
+    form = await request.form()
+
+    delay = Behaviour.latency_ms + random.uniform(-Behaviour.latency_jitter_ms, Behaviour.latency_jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+
+    if method == "getMe":
+        return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}
+    if method not in ("sendMessage", "sendDocument"):
+        return {"ok": True, "result": True}
+
+    roll = random.random()
+    if roll < Behaviour.rate_limit_rate:
+        stats.rate_limited += 1
+        return _error(
+            429, f"Too Many Requests: retry after {Behaviour.retry_after_seconds}",
+            retry_after=Behaviour.retry_after_seconds
+        )
+    roll -= Behaviour.rate_limit_rate
+    if roll < Behaviour.error_rate:
+        stats.errors += 1
+        return _error(400, "Bad Request: chat not found")
+    roll -= Behaviour.error_rate
+    if roll < Behaviour.server_error_rate:
+        stats.server_errors += 1
+        return _error(502, "Bad Gateway")
+
+    chat_id = form["chat_id"]
+    if method == "sendDocument":
+        stats.documents += 1
+        return _message(chat_id, document={"file_id": f"doc-{stats.documents}", "file_unique_id": f"u-{stats.documents}"})
+
+    stats.record_delivery(form["text"])
+    return _message(chat_id, text=form["text"])
+
+
+@app.get("/stats")
+async def get_stats():
+    """Counters and lateness samples recorded since the last reset"""
+    return vars(stats)
+
+
+@app.post("/stats/reset")
+async def reset_stats():
+    """Start counting from zero"""
+    global stats
+    stats = Stats()
+    return {"ok": True}
+
+
+def main() -> None:
+    """Start the fake Bot API server"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay before every answer")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0, help="Uniform +/- jitter on the delay")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Share of sends answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of injected 429s, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of sends answered with a permanent 400")
+    parser.add_argument("--server-error-rate", type=float, default=0, help="Share of sends answered with a transient 502")
+    args = parser.parse_args()
+
+    Behaviour.latency_ms = args.latency_ms
+    Behaviour.latency_jitter_ms = args.latency_jitter_ms
+    Behaviour.rate_limit_rate = args.rate_limit_rate
+    Behaviour.retry_after_seconds = args.retry_after
+    Behaviour.error_rate = args.error_rate
+    Behaviour.server_error_rate = args.server_error_rate
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
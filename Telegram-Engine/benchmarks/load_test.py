@@ -0,0 +1,311 @@
+"""
+Load test - End-to-end throughput of scheduling and delivering messages.
+
+For each recipient count, starts a fresh stack on an empty database:
+- the fake Bot API (fake_bot_api.py) with the chosen latency and error injection
+- the API (uvicorn api:app) with the scheduler in its own process, as main.py runs them
+
+and then:
+1. subscribes the recipients through POST /subscribe-user at --subscribe-rate
+2. puts them in an audience group (or lists them in target_user_id with --target users)
+3. schedules --messages messages through POST /schedule-message at --schedule-rate,
+   each due --lead-seconds after it was sent
+4. waits until the API reports every message as sent
+
+Reported per scenario: ingest throughput and latency of both endpoints,
+delivery lateness percentiles (delivery time at the fake Bot API minus the
+message's scheduled_timestamp), fan-out time from the first due time to the
+last delivery, and deliveries per second. Results are written as JSON (see
+report.py) so runs on different commits can be compared with compare.py.
+
+Engine settings not covered by a flag (DELIVERY_BATCH_SIZE,
+TELEGRAM_MAX_CONCURRENT_SENDS, ...) are passed through from the environment.
+
+Run with: python benchmarks/load_test.py --recipients 1000,10000,100000
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from report import percentiles, write_report
+
+ENGINE_DIR = Path(__file__).resolve().parent.parent
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+
+SENDER = "load-test"
+# Benchmark subscribers get chat_ids from here on
+CHAT_ID_BASE = 10 ** 9
+# Seconds to wait for a started service to answer
+STARTUP_TIMEOUT_SECONDS = 30
+
+
+def free_port() -> int:
+    """A port nothing is listening on right now"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Stack:
+    """The fake Bot API, the API and the scheduler, each in its own process"""
+
+    def __init__(self, args: argparse.Namespace, workdir: Path):
+        self.args = args
+        self.workdir = workdir
+        self.fake_url = f"http://127.0.0.1:{free_port()}"
+        self.api_url = f"http://127.0.0.1:{free_port()}"
+        self._processes: List[subprocess.Popen] = []
+
+    def _start(self, name: str, command: List[str], env: Optional[Dict[str, str]] = None) -> None:
+        log = open(self.workdir / f"{name}.log", "w")
+        self._processes.append(subprocess.Popen(
+            command, cwd=self.workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+        ))
+
+    def _engine_env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "PYTHONPATH": str(ENGINE_DIR),
+            "TELEGRAM_BOT_TOKEN": "123456:load-test",
+            "TELEGRAM_API_BASE_URL": f"{self.fake_url}/bot",
+            "DATABASE_URL": self.args.database_url or f"sqlite:///{self.workdir / 'load_test.db'}",
+            "EMBEDDED_SCHEDULER": "false",
+            "SCHEDULER_NOTIFY_PORT": str(free_port()),
+            "SCHEDULER_METRICS_PORT": "0",
+            "TELEGRAM_GLOBAL_RATE_LIMIT": str(self.args.global_rate),
+            "TELEGRAM_PER_CHAT_RATE_LIMIT": str(self.args.per_chat_rate),
+            "DELIVERY_RETRY_BASE_SECONDS": str(self.args.retry_base_seconds),
+        })
+        env.pop("TELEGRAM_WEBHOOK_URL", None)
+        return env
+
+    async def __aenter__(self) -> "Stack":
+        fake_port = self.fake_url.rsplit(":", 1)[1]
+        self._start("fake_bot_api", [
+            sys.executable, str(BENCHMARKS_DIR / "fake_bot_api.py"),
+            "--port", fake_port,
+            "--latency-ms", str(self.args.latency_ms),
+            "--latency-jitter-ms", str(self.args.latency_jitter_ms),
+            "--rate-limit-rate", str(self.args.rate_limit_rate),
+            "--retry-after", str(self.args.retry_after),
+            "--error-rate", str(self.args.error_rate),
+            "--server-error-rate", str(self.args.server_error_rate),
+        ])
+        await self._wait_until_up(f"{self.fake_url}/stats")
+
+        env = self._engine_env()
+        api_port = self.api_url.rsplit(":", 1)[1]
+        self._start("api", [
+            sys.executable, "-m", "uvicorn", "api:app",
+            "--host", "127.0.0.1", "--port", api_port, "--log-level", "warning"
+        ], env)
+        await self._wait_until_up(f"{self.api_url}/")
+        self._start("scheduler", [sys.executable, str(ENGINE_DIR / "scheduler.py")], env)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        for process in reversed(self._processes):
+            process.terminate()
+        for process in self._processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    async def _wait_until_up(self, url: str) -> None:
+        deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                try:
+                    if (await client.get(url)).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError(f"{url} did not come up, see the logs in {self.workdir}")
+
+
+async def drive(count: int, rate: float, concurrency: int, request) -> dict:
+    """
+    Issue `count` requests, started at `rate` per second (0: as fast as
+    possible) with at most `concurrency` in flight.
+
+    `request(i)` performs request i and returns its response. Returns the
+    per-request latencies, error count and elapsed time.
+    """
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        try:
+            request_started = time.perf_counter()
+            response = await request(i)
+            latencies.append(time.perf_counter() - request_started)
+            if response.status_code >= 400:
+                errors += 1
+        except httpx.HTTPError:
+            errors += 1
+        finally:
+            semaphore.release()
+
+    tasks = []
+    for i in range(count):
+        if rate > 0:
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(one(i)))
+    await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": count,
+        "errors": errors,
+        "seconds": elapsed,
+        "per_second": count / elapsed if elapsed else 0.0,
+        **percentiles((latency * 1000 for latency in latencies), prefix="latency_ms_"),
+    }
+
+
+async def run_scenario(args: argparse.Namespace, recipients: int) -> dict:
+    """Subscribe, schedule and deliver to `recipients` users on a fresh stack"""
+    workdir = Path(tempfile.mkdtemp(prefix=f"load-test-{recipients}-"))
+    print(f"[{recipients} recipients] starting services in {workdir}", file=sys.stderr)
+
+    async with Stack(args, workdir) as stack:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=stack.api_url, limits=limits, timeout=args.request_timeout) as client:
+            user_ids: List[Optional[str]] = [None] * recipients
+
+            async def subscribe(i: int) -> httpx.Response:
+                response = await client.post("/subscribe-user", json={
+                    "chat_id": str(CHAT_ID_BASE + i), "chat_name": f"load-test-{i}"
+                })
+                if response.status_code == 200:
+                    user_ids[i] = response.json()["user_id"]
+                return response
+
+            print(f"[{recipients} recipients] subscribing", file=sys.stderr)
+            subscribe_stats = await drive(recipients, args.subscribe_rate, args.concurrency, subscribe)
+            subscribed = [user_id for user_id in user_ids if user_id is not None]
+
+            if args.target == "group":
+                response = await client.post("/groups", json={"name": "load-test", "user_ids": subscribed})
+                response.raise_for_status()
+                target = {"target_group_id": response.json()["group_id"]}
+            else:
+                target = {"target_user_id": ",".join(subscribed)}
+
+            due_times: List[float] = []
+
+            async def schedule(i: int) -> httpx.Response:
+                due = time.time() + args.lead_seconds
+                due_times.append(due)
+                scheduled_timestamp = datetime.fromtimestamp(due, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+                return await client.post("/schedule-message", data={
+                    "from_sender": SENDER,
+                    **target,
+                    # The fake Bot API measures lateness from the timestamp after the "@"
+                    "message": f"Load test message {i} @{due:.6f}",
+                    "scheduled_timestamp": scheduled_timestamp
+                })
+
+            print(f"[{recipients} recipients] scheduling {args.messages} message(s)", file=sys.stderr)
+            schedule_stats = await drive(args.messages, args.schedule_rate, args.concurrency, schedule)
+
+            print(f"[{recipients} recipients] waiting for delivery", file=sys.stderr)
+            deadline = time.monotonic() + args.timeout
+            while True:
+                unsent = (await client.get("/pending-messages", params={
+                    "from_sender": SENDER, "is_sent": "false", "limit": 1
+                })).json()
+                if not unsent:
+                    break
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Messages still unsent after {args.timeout}s, see the logs in {workdir}")
+                await asyncio.sleep(args.poll_seconds)
+
+        async with httpx.AsyncClient() as client:
+            fake = (await client.get(f"{stack.fake_url}/stats")).json()
+
+    delivered = fake["delivered"]
+    delivery_span = (fake["last_delivery_at"] - fake["first_delivery_at"]) if delivered else 0.0
+    result = {
+        "recipients": recipients,
+        "messages": args.messages,
+        "expected_deliveries": len(subscribed) * args.messages,
+        "subscribe_per_second": subscribe_stats["per_second"],
+        "schedule_per_second": schedule_stats["per_second"],
+        **{f"subscribe_{key}": value for key, value in subscribe_stats.items() if key != "per_second"},
+        **{f"schedule_{key}": value for key, value in schedule_stats.items() if key != "per_second"},
+        "delivered": delivered,
+        "bot_api_requests": fake["requests"],
+        "injected_rate_limits": fake["rate_limited"],
+        "injected_errors": fake["errors"],
+        "injected_server_errors": fake["server_errors"],
+        "fanout_seconds": (fake["last_delivery_at"] - min(due_times)) if delivered and due_times else 0.0,
+        "deliveries_per_second": delivered / delivery_span if delivery_span else 0.0,
+        **percentiles(fake["lateness"], prefix="lateness_seconds_"),
+    }
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main() -> None:
+    """Run the load test for each recipient count and write the report"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipients", default="1000,10000,100000",
+                        help="Comma-separated recipient counts, one scenario each")
+    parser.add_argument("--messages", type=int, default=1, help="Messages scheduled per scenario")
+    parser.add_argument("--target", choices=["group", "users"], default="group",
+                        help="Address recipients by audience group or by listing them in target_user_id")
+    parser.add_argument("--subscribe-rate", type=float, default=0, help="/subscribe-user requests per second (0: unlimited)")
+    parser.add_argument("--schedule-rate", type=float, default=0, help="/schedule-message requests per second (0: unlimited)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at most")
+    parser.add_argument("--lead-seconds", type=float, default=5, help="How far in the future each message is due")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Fake Bot API answer delay")
+    parser.add_argument("--latency-jitter-ms", type=float, default=5)
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Share of sends answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of injected 429s, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of sends failing permanently (400)")
+    parser.add_argument("--server-error-rate", type=float, default=0, help="Share of sends failing transiently (502)")
+    parser.add_argument("--global-rate", type=float, default=1000,
+                        help="TELEGRAM_GLOBAL_RATE_LIMIT for the run; real Telegram allows about 30")
+    parser.add_argument("--per-chat-rate", type=float, default=1, help="TELEGRAM_PER_CHAT_RATE_LIMIT for the run")
+    parser.add_argument("--retry-base-seconds", type=float, default=1, help="DELIVERY_RETRY_BASE_SECONDS for the run")
+    parser.add_argument("--database-url", help="Database to use instead of a fresh SQLite file; must be empty")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds to wait for delivery per scenario")
+    parser.add_argument("--poll-seconds", type=float, default=0.5, help="Interval of the delivery check")
+    parser.add_argument("--request-timeout", type=float, default=60, help="Timeout of each API request")
+    parser.add_argument("--keep", action="store_true", help="Keep each scenario's database and logs")
+    parser.add_argument("--output", type=Path, help="Report path (default: results/load_test-<commit>.json)")
+    args = parser.parse_args()
+
+    results = {}
+    for recipients in (int(value) for value in args.recipients.split(",")):
+        results[f"recipients_{recipients}"] = asyncio.run(run_scenario(args, recipients))
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "keep")}
+    path = write_report("load_test", config, results, args.output)
+    print(f"Report written to {path}", file=sys.stderr)
+    print(path.read_text())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Micro-benchmarks - Repeatable timings of the engine's hot paths.
+
+For each data size, a fresh SQLite database is generated with that many
+subscribers and scheduled messages (1% of them due), from a fixed seed, and
+every benchmark runs against it in-process:
+
+- due_claim_sweep / due_claim_ids: leases.claim_messages, the due-message
+  query of check_and_send_due_messages (sweep, and for a batch of due ids)
+- chat_id_cold / chat_id_warm: get_chat_id_from_user_id without and with
+  the subscriber cache; chat_id_batch_cold: get_chat_ids_for_user_ids for
+  one delivery batch of 100 user_ids
+- pending_messages_serialization: validating and JSON-encoding `size`
+  messages as List[ScheduleMessageResponse], the way FastAPI renders
+  /pending-messages
+- schedule_message_form: POST /schedule-message through the ASGI app,
+  form parsing and upload storage included, per attachment size
+  (independent of the data size)
+
+Each benchmark runs until it has at least --min-rounds rounds and
+--min-seconds of timed work, after untimed warmup rounds. Results are written
+as JSON (see report.py); compare two runs with compare.py.
+
+Run with: python benchmarks/micro.py --sizes 1000,10000,100000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from report import percentiles, write_report
+
+ENGINE_DIR = Path(__file__).resolve().parent.parent
+INVOKED_FROM = Path.cwd()
+WORKDIR = Path(tempfile.mkdtemp(prefix="micro-benchmarks-"))
+
+# The engine reads its configuration at import time
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR / 'micro.db'}"
+os.environ["EMBEDDED_SCHEDULER"] = "false"
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:micro-benchmarks")
+os.environ.setdefault("SCHEDULER_NOTIFY_PORT", "9")  # discard
+sys.path.insert(0, str(ENGINE_DIR))
+os.chdir(WORKDIR)
+
+import httpx  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import insert, select, update  # noqa: E402
+
+import api  # noqa: E402
+import leases  # noqa: E402
+from database import SessionLocal, engine, init_db  # noqa: E402
+from models import Base, ScheduledMessage, SubscribedUser  # noqa: E402
+from schemas import ScheduleMessageResponse  # noqa: E402
+from telegram_messenger import get_chat_id_from_user_id, get_chat_ids_for_user_ids, subscriber_cache  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+SEED = 20240101
+WARMUP_ROUNDS = 2
+# Rows per INSERT statement while generating the database
+SEED_CHUNK_SIZE = 5000
+# Recipients per message in the generated data
+RECIPIENTS_PER_MESSAGE = 5
+# user_ids resolved together, as in one outbox batch
+DELIVERY_BATCH_SIZE = 100
+
+
+class Settings:
+    min_rounds = 5
+    min_seconds = 1.0
+    max_rounds = 10000
+
+
+async def measure(operation: Callable[[], Awaitable], setup: Optional[Callable[[], Awaitable]] = None) -> dict:
+    """Time `operation` repeatedly, running `setup` untimed before each call"""
+    times: List[float] = []
+    round_number = 0
+    while True:
+        if setup is not None:
+            await setup()
+        started = time.perf_counter()
+        await operation()
+        elapsed = time.perf_counter() - started
+        round_number += 1
+        if round_number > WARMUP_ROUNDS:
+            times.append(elapsed)
+            if len(times) >= Settings.max_rounds or (
+                len(times) >= Settings.min_rounds and sum(times) >= Settings.min_seconds
+            ):
+                break
+    return {
+        "rounds": len(times),
+        "ops_per_second": len(times) / sum(times),
+        **percentiles((t * 1000 for t in times), prefix="ms_"),
+    }
+
+
+class Dataset:
+    """Ids of the generated rows, for the benchmarks to pick from"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.user_ids: List[str] = []
+        self.due_ids: List[str] = []
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+async def generate_database(size: int) -> Dataset:
+    """Recreate the tables with `size` subscribers and `size` messages, 1% of them due"""
+    rng = random.Random(SEED + size)
+    dataset = Dataset(size)
+    now = datetime.utcnow()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await init_db()
+
+    dataset.user_ids = [_uuid(rng) for _ in range(size)]
+    subscribers = [
+        {"user_id": user_id, "chat_id": str(10 ** 9 + i), "chat_name": f"user-{i}", "created_at": now}
+        for i, user_id in enumerate(dataset.user_ids)
+    ]
+    due_count = max(size // 100, 1)
+    messages = []
+    for i in range(size):
+        message_id = _uuid(rng)
+        due = i < due_count
+        if due:
+            dataset.due_ids.append(message_id)
+        messages.append({
+            "id": message_id,
+            "from_sender": f"sender-{i % 10}",
+            "target_user_id": rng.sample(dataset.user_ids, min(RECIPIENTS_PER_MESSAGE, size)),
+            "message": f"Generated message {i} " + "x" * rng.randint(20, 400),
+            "scheduled_timestamp": now + timedelta(seconds=-rng.randint(1, 3600) if due else rng.randint(60, 30 * 86400)),
+            "file_paths": [f"uploads/{_uuid(rng)}.pdf"] if rng.random() < 0.2 else None,
+            "is_sent": False,
+            "created_at": now,
+        })
+
+    async with SessionLocal() as db:
+        for rows, model in ((subscribers, SubscribedUser), (messages, ScheduledMessage)):
+            for start in range(0, len(rows), SEED_CHUNK_SIZE):
+                await db.execute(insert(model), rows[start:start + SEED_CHUNK_SIZE])
+        await db.commit()
+    return dataset
+
+
+async def bench_due_query(dataset: Dataset) -> Dict[str, dict]:
+    """leases.claim_messages as a sweep and for a batch of due ids"""
+    async with SessionLocal() as db:
+        async def release_all():
+            await db.execute(update(ScheduledMessage).values(lease_token=None, lease_expires_at=None))
+            await db.commit()
+
+        ids = dataset.due_ids[:leases.CLAIM_BATCH_SIZE]
+        return {
+            "due_claim_sweep": await measure(lambda: leases.claim_messages(db, datetime.utcnow()), release_all),
+            "due_claim_ids": await measure(lambda: leases.claim_messages(db, datetime.utcnow(), ids), release_all),
+        }
+
+
+async def bench_chat_id_resolution(dataset: Dataset) -> Dict[str, dict]:
+    """user_id -> chat_id lookups, one at a time and per delivery batch"""
+    rng = random.Random(SEED)
+    async with SessionLocal() as db:
+        async def clear_cache():
+            subscriber_cache.clear()
+
+        async def one():
+            await get_chat_id_from_user_id(db, rng.choice(dataset.user_ids))
+
+        async def batch():
+            await get_chat_ids_for_user_ids(db, rng.sample(dataset.user_ids, min(DELIVERY_BATCH_SIZE, dataset.size)))
+
+        results = {
+            "chat_id_cold": await measure(one, clear_cache),
+            "chat_id_batch_cold": await measure(batch, clear_cache),
+        }
+        # Warm: every subscriber cached
+        await get_chat_ids_for_user_ids(db, dataset.user_ids)
+        results["chat_id_warm"] = await measure(one)
+        return results
+
+
+async def bench_serialization(dataset: Dataset) -> Dict[str, dict]:
+    """List[ScheduleMessageResponse] validation and JSON encoding of `size` ORM rows"""
+    adapter = TypeAdapter(List[ScheduleMessageResponse])
+    async with SessionLocal() as db:
+        rows = list(await db.scalars(select(ScheduledMessage).limit(dataset.size)))
+
+    async def render():
+        # What FastAPI does for response_model: validate, dump in JSON mode, encode
+        json.dumps(adapter.dump_python(adapter.validate_python(rows, from_attributes=True), mode="json"))
+
+    return {"pending_messages_serialization": await measure(render)}
+
+
+async def bench_schedule_message(file_sizes: List[int], dataset: Dataset) -> Dict[str, dict]:
+    """POST /schedule-message through the ASGI app, per attachment size"""
+    results = {}
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://micro") as client:
+        for file_bytes in file_sizes:
+            payload = os.urandom(file_bytes)
+            counter = iter(range(10 ** 9))
+
+            async def post():
+                # Distinct content every time, so each upload is stored rather than deduplicated
+                files = [("files", ("attachment.bin", next(counter).to_bytes(8, "big") + payload))] if file_bytes else None
+                response = await client.post("/schedule-message", data={
+                    "from_sender": "micro",
+                    "target_user_id": ",".join(dataset.user_ids[:RECIPIENTS_PER_MESSAGE]),
+                    "message": "Micro-benchmark message",
+                    "scheduled_timestamp": (datetime.utcnow() + timedelta(days=1)).isoformat() + "Z",
+                }, files=files)
+                response.raise_for_status()
+
+            results[f"schedule_message_form[file_bytes={file_bytes}]"] = await measure(post)
+    return results
+
+
+BENCHMARKS = {
+    "due_query": bench_due_query,
+    "chat_id": bench_chat_id_resolution,
+    "serialization": bench_serialization,
+}
+
+
+async def run(args: argparse.Namespace) -> Dict[str, dict]:
+    results = {}
+    selected = args.only.split(",") if args.only else list(BENCHMARKS) + ["schedule_message"]
+    sizes = [int(value) for value in args.sizes.split(",")]
+    dataset = None
+    for size in sizes:
+        print(f"[size {size}] generating database", file=sys.stderr)
+        dataset = await generate_database(size)
+        for name, benchmark in BENCHMARKS.items():
+            if name not in selected:
+                continue
+            print(f"[size {size}] {name}", file=sys.stderr)
+            for scenario, result in (await benchmark(dataset)).items():
+                results[f"{scenario}[size={size}]"] = result
+
+    if "schedule_message" in selected:
+        print("schedule_message", file=sys.stderr)
+        file_sizes = [int(value) for value in args.file_sizes.split(",")]
+        results.update(await bench_schedule_message(file_sizes, dataset))
+    await engine.dispose()
+    return results
+
+
+def main() -> None:
+    """Run the micro-benchmarks and write the report"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated row counts of the generated database")
+    parser.add_argument("--file-sizes", default="0,65536,1048576,8388608",
+                        help="Comma-separated attachment sizes for schedule_message, in bytes (0: no attachment)")
+    parser.add_argument("--only", help=f"Comma-separated subset of: {', '.join(list(BENCHMARKS) + ['schedule_message'])}")
+    parser.add_argument("--min-rounds", type=int, default=Settings.min_rounds)
+    parser.add_argument("--min-seconds", type=float, default=Settings.min_seconds)
+    parser.add_argument("--max-rounds", type=int, default=Settings.max_rounds)
+    parser.add_argument("--output", type=Path, help="Report path (default: results/micro-<commit>.json)")
+    args = parser.parse_args()
+    # Relative to where the command was run, not the temporary working directory
+    if args.output is not None:
+        args.output = INVOKED_FROM / args.output
+
+    Settings.min_rounds = args.min_rounds
+    Settings.min_seconds = args.min_seconds
+    Settings.max_rounds = args.max_rounds
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    path = write_report("micro", config, results, args.output)
+    print(f"Report written to {path}", file=sys.stderr)
+    print(path.read_text())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark reports - Shared result format for the benchmark suites.
+
+Every suite writes one JSON file per run:
+
+    {
+      "suite": "load_test",
+      "commit": "3f2c1ab",
+      "dirty": false,
+      "created_at": "2026-01-01T12:00:00Z",
+      "python": "3.11.7",
+      "config": {...},
+      "results": {"<scenario>": {"<metric>": <number>, ...}, ...}
+    }
+
+Metrics are flat numbers, so two reports of the same suite can be compared
+scenario by scenario, metric by metric.
+"""
+import json
+import math
+import platform
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+# Default location of written reports
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def git_commit() -> Tuple[str, bool]:
+    """Short hash of the checked-out commit and whether the tree has changes"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=RESULTS_DIR.parent
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True, cwd=RESULTS_DIR.parent
+        ).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def percentiles(values: Iterable[float], prefix: str = "") -> Dict[str, float]:
+    """p50/p90/p95/p99, mean and max of a sample (nearest rank), keyed with an optional prefix"""
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+
+    def rank(p: float) -> float:
+        return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+    return {
+        f"{prefix}p50": rank(50),
+        f"{prefix}p90": rank(90),
+        f"{prefix}p95": rank(95),
+        f"{prefix}p99": rank(99),
+        f"{prefix}mean": sum(ordered) / len(ordered),
+        f"{prefix}max": ordered[-1],
+    }
+
+
+def write_report(
+    suite: str, config: dict, results: Dict[str, dict], output: Optional[Path] = None, results_dir: Path = RESULTS_DIR
+) -> Path:
+    """Write a run's report and return its path (<results_dir>/<suite>-<commit>.json by default)"""
+    commit, dirty = git_commit()
+    report = {
+        "suite": suite,
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "config": config,
+        "results": results,
+    }
+    if output is None:
+        output = results_dir / f"{suite}-{commit}{'-dirty' if dirty else ''}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    return output
@@ -1,7 +1,13 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import event, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from models import Base
+import logging
 import os
+import threading
+import time
 
 # Database configuration
 # Use SQLite by default for easier setup (no PostgreSQL installation required)
@@ -11,21 +17,198 @@ DATABASE_URL = os.getenv(
     "sqlite:///./scheduled_messages.db"
 )
 
-# SQLite requires check_same_thread=False for FastAPI
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async drivers used for each backend, so database I/O never blocks the event loop
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
 
-def init_db():
-    """Initialize database tables"""
-    Base.metadata.create_all(bind=engine)
+# SQLite storage profile, applied to every new connection. WAL lets the
+# scheduler write while the API reads; busy_timeout makes a writer wait for
+# the lock instead of failing with "database is locked".
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # Negative: KiB, so 64 MB
 
-def get_db():
+# Connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+
+def to_async_url(url: str) -> str:
+    """Swap a plain database URL's driver for its async counterpart"""
+    parsed = make_url(url)
+    backend = parsed.drivername.split("+")[0]
+    if backend not in ASYNC_DRIVERS:
+        return url
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+class PoolStats:
+    """Counters for connection pool activity, including time spent waiting for a connection"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def increment(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self, pool) -> dict:
+        """Current counters plus the pool's live occupancy"""
+        with self._lock:
+            stats = {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+            }
+        stats["wait_seconds_avg"] = round(stats["wait_seconds_total"] / stats["checkouts"], 6) if stats["checkouts"] else 0.0
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that times how long each checkout waits for a connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            pool_stats.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - started)
+        return connection
+
+
+engine = create_async_engine(
+    to_async_url(DATABASE_URL),
+    poolclass=InstrumentedPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def apply_storage_profile(dbapi_connection, connection_record):
+    """Apply the SQLite pragmas to each new connection"""
+    pool_stats.increment("connects")
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.increment("checkouts")
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def count_checkin(dbapi_connection, connection_record):
+    pool_stats.increment("checkins")
+
+
+@event.listens_for(engine.sync_engine, "invalidate")
+def count_invalidation(dbapi_connection, connection_record, exception):
+    pool_stats.increment("invalidations")
+
+
+def get_pool_stats() -> dict:
+    """Connection pool statistics for monitoring"""
+    return pool_stats.snapshot(engine.pool)
+
+
+logger = logging.getLogger(__name__)
+
+
+def _column_ddl(column, dialect) -> str:
+    """Column definition for ALTER TABLE ADD COLUMN on a table that already has rows"""
+    ddl = f"{dialect.identifier_preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        literal = int(default) if isinstance(default, bool) else default
+        ddl += f" DEFAULT {literal!r}" if isinstance(literal, str) else f" DEFAULT {literal}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    # NOT NULL without a default can't be added to existing rows, so the column stays nullable
+    return ddl
+
+
+def migrate_schema(connection) -> None:
+    """
+    Bring existing tables up to date with the models.
+
+    create_all only creates missing tables, so columns and indexes added to
+    a table that already exists are added here. Safe to run on every start:
+    only what is missing is created.
+    """
+    inspector = inspect(connection)
+    dialect = connection.dialect
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                connection.execute(text(
+                    f"ALTER TABLE {dialect.identifier_preparer.quote(table.name)} ADD COLUMN {_column_ddl(column, dialect)}"
+                ))
+                logger.info(f"Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+async def init_db():
+    """Initialize database tables and migrate existing ones"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(migrate_schema)
+
+def upsert_insert(db: AsyncSession, model):
+    """INSERT construct of the session's backend, which supports ON CONFLICT"""
+    if db.bind.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+async def get_db():
     """Dependency to get database session"""
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,132 @@
+"""
+Delivery leases - Lets several scheduler workers share the due backlog.
+
+Before a worker delivers a message it claims it by writing a random lease
+token and an expiry onto the row. A message can only be claimed while it has
+no lease or its lease has expired, so two workers never deliver the same
+message at once, and a message held by a worker that died is picked up by
+another one once the lease runs out. Long deliveries renew their lease after
+every outbox batch.
+
+On PostgreSQL the candidates are locked with SELECT ... FOR UPDATE SKIP
+LOCKED so concurrent workers skip each other's rows instead of waiting. On
+SQLite, which serializes writers, a conditional UPDATE is atomic on its own.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ScheduledMessage
+
+# How long a claim stays valid without being renewed
+LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", "300"))
+
+# Maximum messages claimed by one statement
+CLAIM_BATCH_SIZE = 500
+
+
+def _lease_is_free(now: datetime):
+    return or_(
+        ScheduledMessage.lease_expires_at.is_(None),
+        ScheduledMessage.lease_expires_at <= now
+    )
+
+
+def _claimable(now: datetime, message_ids: Optional[List[str]], limit: int):
+    query = select(ScheduledMessage.id).where(
+        ScheduledMessage.scheduled_timestamp <= now,
+        ScheduledMessage.is_sent == False,
+        _lease_is_free(now)
+    )
+    if message_ids is not None:
+        query = query.where(ScheduledMessage.id.in_(message_ids))
+    return query.order_by(ScheduledMessage.scheduled_timestamp).limit(limit)
+
+
+async def claim_messages(
+    db: AsyncSession,
+    now: datetime,
+    message_ids: Optional[List[str]] = None,
+    limit: int = CLAIM_BATCH_SIZE
+) -> Tuple[str, List[str]]:
+    """
+    Claim due, unsent messages whose lease is free.
+
+    Args:
+        db: Database session
+        now: Current naive UTC time
+        message_ids: Only consider these messages (at most `limit` of them);
+            None means any due message
+        limit: Maximum number of messages to claim
+
+    Returns:
+        tuple: The lease token and the ids of the messages it now holds
+    """
+    token = str(uuid.uuid4())
+    lease = {
+        ScheduledMessage.lease_token: token,
+        ScheduledMessage.lease_expires_at: now + timedelta(seconds=LEASE_SECONDS)
+    }
+
+    try:
+        if db.bind.dialect.name == "postgresql":
+            claimed = list(await db.scalars(
+                _claimable(now, message_ids, limit).with_for_update(skip_locked=True)
+            ))
+            if claimed:
+                await db.execute(update(ScheduledMessage).where(
+                    ScheduledMessage.id.in_(claimed)
+                ).values(lease).execution_options(synchronize_session=False))
+            await db.commit()
+            return token, claimed
+
+        candidates = list(await db.scalars(_claimable(now, message_ids, limit)))
+        if not candidates:
+            return token, []
+
+        # Re-check the lease in the UPDATE itself; only rows still free are taken
+        await db.execute(update(ScheduledMessage).where(
+            ScheduledMessage.id.in_(candidates),
+            ScheduledMessage.is_sent == False,
+            _lease_is_free(now)
+        ).values(lease).execution_options(synchronize_session=False))
+        await db.commit()
+
+        claimed = list(await db.scalars(select(ScheduledMessage.id).where(
+            ScheduledMessage.id.in_(candidates),
+            ScheduledMessage.lease_token == token
+        ).order_by(ScheduledMessage.scheduled_timestamp)))
+        return token, claimed
+
+    except Exception:
+        await db.rollback()
+        raise
+
+
+async def renew_lease(db: AsyncSession, message_id: str, token: str, until: Optional[datetime] = None) -> bool:
+    """
+    Extend a held lease (by LEASE_SECONDS from now, or until `until`).
+
+    Returns False if the lease was lost to another worker.
+    """
+    expires_at = until or datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+    result = await db.execute(update(ScheduledMessage).where(
+        ScheduledMessage.id == message_id,
+        ScheduledMessage.lease_token == token
+    ).values({ScheduledMessage.lease_expires_at: expires_at}).execution_options(synchronize_session=False))
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def release_lease(db: AsyncSession, message_id: str, token: str) -> None:
+    """Give up a held lease so any worker can claim the message again"""
+    await db.execute(update(ScheduledMessage).where(
+        ScheduledMessage.id == message_id,
+        ScheduledMessage.lease_token == token
+    ).values({
+        ScheduledMessage.lease_token: None,
+        ScheduledMessage.lease_expires_at: None
+    }).execution_options(synchronize_session=False))
+    await db.commit()
@@ -1,15 +1,21 @@
 """
 Main entry point for the Scheduled Message System.
 
-This module starts both the FastAPI server and Telegram bot concurrently.
+This module starts the FastAPI server, the message scheduler and the Telegram
+bot as separate processes, and restarts any of them that crashes.
 Run with: python main.py
 """
 import multiprocessing
+import os
 import signal
 import sys
 import time
 import logging
 import uvicorn
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
 
 # Configure logging
 logging.basicConfig(
@@ -19,20 +25,32 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-run_telegram = True
+# In webhook mode the API receives Telegram updates, so no polling bot is started
+run_telegram = not os.getenv("TELEGRAM_WEBHOOK_URL")
+
+# Number of uvicorn worker processes serving the API
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
 
 
 def run_api_server():
     """Run the FastAPI server on port 8000"""
-    from api import app
+    # The scheduler runs in its own process, so the API only notifies it
+    os.environ["EMBEDDED_SCHEDULER"] = "false"
     uvicorn.run(
-        app,
+        "api:app",
         host="0.0.0.0",
         port=8000,
+        workers=API_WORKERS,
         log_level="warning"
     )
 
 
+def run_scheduler():
+    """Run the message scheduler on its own event loop"""
+    from scheduler import main as scheduler_main
+    scheduler_main()
+
+
 def run_telegram_bot():
     """Run the Telegram bot"""
     from telegram_bot import main as telegram_main
@@ -51,8 +69,9 @@ def main():
     # Set up signal handler for graceful shutdown
     signal.signal(signal.SIGINT, signal_handler)
 
-    # Create processes for both services
+    # Create processes for all services
     api_process = multiprocessing.Process(target=run_api_server, name="API-Server")
+    scheduler_process = multiprocessing.Process(target=run_scheduler, name="Message-Scheduler")
     if run_telegram:
         bot_process = multiprocessing.Process(target=run_telegram_bot, name="Telegram-Bot")
 
@@ -61,22 +80,31 @@ def main():
         logger.info("Starting Scheduled Message System")
         logger.info("="*60)
 
-        logger.info("Starting FastAPI server on port 8000...")
+        logger.info(f"Starting FastAPI server on port 8000 ({API_WORKERS} worker(s))...")
         api_process.start()
         time.sleep(1)  # Give API server a moment to start
 
+        logger.info("Starting message scheduler...")
+        scheduler_process.start()
+
         if run_telegram:
             logger.info("Starting Telegram bot...")
             bot_process.start()
             time.sleep(1)  # Give Telegram bot a moment to start
 
-            logger.info("\n" + "="*60)
-            logger.info("Both services are running successfully!")
-            logger.info("  - FastAPI: http://localhost:8000")
-            logger.info("  - API Docs: http://localhost:8000/docs")
+        logger.info("\n" + "="*60)
+        logger.info("All services are running successfully!")
+        logger.info("  - FastAPI: http://localhost:8000")
+        logger.info("  - API Docs: http://localhost:8000/docs")
+        logger.info("  - Message Scheduler: Running in its own process")
+        logger.info("  - Metrics: http://localhost:8000/metrics (scheduler on port "
+                    f"{os.getenv('SCHEDULER_METRICS_PORT', '8001')})")
+        if run_telegram:
             logger.info("  - Telegram Bot: Running in polling mode")
-            logger.info("\nPress Ctrl+C to stop both services")
-            logger.info("="*60 + "\n")
+        else:
+            logger.info("  - Telegram Bot: Receiving updates by webhook in the API")
+        logger.info("\nPress Ctrl+C to stop all services")
+        logger.info("="*60 + "\n")
 
         # Monitor processes and restart if they crash
         while True:
@@ -84,7 +112,12 @@ def main():
                 logger.warning("API server process died. Restarting...")
                 api_process = multiprocessing.Process(target=run_api_server, name="API-Server")
                 api_process.start()
-            
+
+            if not scheduler_process.is_alive():
+                logger.warning("Message scheduler process died. Restarting...")
+                scheduler_process = multiprocessing.Process(target=run_scheduler, name="Message-Scheduler")
+                scheduler_process.start()
+
             if run_telegram:
                 if not bot_process.is_alive():
                     logger.warning("Telegram bot process died. Restarting...")
@@ -98,7 +131,7 @@ def main():
     except Exception as e:
         logger.error(f"\n\nError occurred: {e}")
     finally:
-        # Ensure both processes are terminated
+        # Ensure all processes are terminated
         logger.info("Stopping API server...")
         if api_process.is_alive():
             api_process.terminate()
@@ -106,6 +139,13 @@ def main():
             if api_process.is_alive():
                 api_process.kill()
 
+        logger.info("Stopping message scheduler...")
+        if scheduler_process.is_alive():
+            scheduler_process.terminate()
+            scheduler_process.join(timeout=5)
+            if scheduler_process.is_alive():
+                scheduler_process.kill()
+
         if run_telegram:
             logger.info("Stopping Telegram bot...")
             if bot_process.is_alive():
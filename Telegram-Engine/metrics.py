@@ -0,0 +1,106 @@
+"""
+Metrics - Prometheus instrumentation for the API and the scheduler.
+
+Every measurement is a prometheus_client counter, gauge or histogram updated
+in place, so recording one is a few arithmetic operations and nothing is
+buffered or sent anywhere. Prometheus scrapes the current values from:
+- the API at GET /metrics (request latency, plus the scheduler's metrics
+  when the scheduler is embedded)
+- a standalone scheduler at SCHEDULER_METRICS_PORT
+
+With several API workers, or to serve everything from the API, point
+PROMETHEUS_MULTIPROC_DIR at an empty directory shared by all processes;
+prometheus_client then keeps the values in files there and every scrape
+aggregates them.
+"""
+import logging
+import os
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    start_http_server,
+)
+from prometheus_client import multiprocess
+
+logger = logging.getLogger(__name__)
+
+# Port of the standalone scheduler's metrics endpoint (0 disables it)
+SCHEDULER_METRICS_PORT = int(os.getenv("SCHEDULER_METRICS_PORT", "8001"))
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Delivery lateness ranges from sub-second (timer queue) to hours (retries)
+LATENESS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "API request latency until the response starts, by route template",
+    ["method", "route", "status"],
+)
+
+DELIVERY_LATENESS = Histogram(
+    "scheduler_delivery_lateness_seconds",
+    "Time between a message's scheduled_timestamp and its delivery to a recipient",
+    buckets=LATENESS_BUCKETS,
+)
+
+DUE_QUEUE_DEPTH = Gauge(
+    "scheduler_due_queue_depth",
+    "Messages held in the scheduler's in-memory timer queue",
+    multiprocess_mode="livesum",
+)
+
+MESSAGES_SENT = Counter(
+    "telegram_messages_sent_total",
+    "Recipients a message was delivered to",
+)
+
+SEND_FAILURES = Counter(
+    "telegram_send_failures_total",
+    "Failed deliveries to a recipient, by exception class",
+    ["error_class"],
+)
+
+SEND_DURATION = Histogram(
+    "telegram_send_duration_seconds",
+    "Time to deliver a message and its attachments to one chat, rate limiting included",
+)
+
+API_CALL_DURATION = Histogram(
+    "telegram_api_call_duration_seconds",
+    "Latency of a single Bot API request, by method",
+    ["method"],
+)
+
+
+def _registry() -> CollectorRegistry:
+    """Registry to expose: this process, or every process in multiprocess mode"""
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render() -> Tuple[bytes, str]:
+    """Current metrics in the Prometheus text format, with their content type"""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server() -> None:
+    """Serve /metrics for a standalone process on SCHEDULER_METRICS_PORT"""
+    if not SCHEDULER_METRICS_PORT:
+        return
+    try:
+        start_http_server(SCHEDULER_METRICS_PORT, registry=_registry())
+        logger.info(f"Serving metrics on port {SCHEDULER_METRICS_PORT}")
+    except OSError as e:
+        logger.warning(f"Not serving metrics on port {SCHEDULER_METRICS_PORT}: {str(e)}")
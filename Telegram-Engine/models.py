@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Boolean, JSON, Integer
+from sqlalchemy import Column, String, DateTime, Boolean, JSON, Integer, Index, false
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -15,6 +15,38 @@ class ScheduledMessage(Base):
     file_paths = Column(JSON, nullable=True)  # Store list as JSON for SQLite compatibility
     is_sent = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    lease_token = Column(String, nullable=True)  # Scheduler worker currently delivering this message
+    lease_expires_at = Column(DateTime, nullable=True)
+    recurrence = Column(String, nullable=True)  # cron or RRULE; scheduled_timestamp is then the next occurrence
+    recurrence_start = Column(DateTime, nullable=True)  # First occurrence, the anchor of RRULEs
+    target_group_id = Column(String, nullable=True)  # Audience group expanded at delivery time
+
+    __table_args__ = (
+        # Scheduler hot path: unsent messages by deadline. Partial, so sent history doesn't bloat it.
+        Index(
+            "ix_scheduled_messages_unsent_due",
+            "scheduled_timestamp", "id",
+            postgresql_where=(is_sent == false()),
+            sqlite_where=(is_sent == false())
+        ),
+        # /pending-messages: a sender's messages by deadline
+        Index("ix_scheduled_messages_sender_due", "from_sender", "scheduled_timestamp", "id"),
+    )
+
+class MessageDelivery(Base):
+    __tablename__ = "message_deliveries"
+
+    message_id = Column(String, primary_key=True)
+    user_id = Column(String, primary_key=True)
+    status = Column(String, nullable=False, default="pending")  # pending, sent or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)  # Earliest retry time, None when due now
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Outbox batches: a message's pending recipients that are due for an attempt
+        Index("ix_message_deliveries_pending", "message_id", "status", "next_attempt_at"),
+    )
 
 class SubscribedUser(Base):
     __tablename__ = "subscribed_users"
@@ -24,4 +56,27 @@ class SubscribedUser(Base):
     chat_name = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class AudienceGroup(Base):
+    __tablename__ = "audience_groups"
+
+    group_id = Column(String, primary_key=True)
+    name = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
+class AudienceGroupMember(Base):
+    __tablename__ = "audience_group_members"
+
+    # The primary key doubles as the index for reading a group's members in order
+    group_id = Column(String, primary_key=True)
+    user_id = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Attachment(Base):
+    __tablename__ = "attachments"
+
+    file_path = Column(String, primary_key=True)
+    telegram_file_id = Column(String, nullable=True)  # Set after the first successful upload
+    content_hash = Column(String, nullable=True, index=True)  # SHA-256 of the file, computed while it was received
+    size_bytes = Column(Integer, nullable=True)
+    ref_count = Column(Integer, nullable=False, default=1)  # Scheduled messages attaching this file
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,165 @@
+"""
+Delivery outbox - Per-recipient delivery state for scheduled messages.
+
+When a message becomes due, one message_deliveries row is created for every
+recipient. The scheduler then drains the pending rows in batches and records
+each batch's outcome before sending the next one, so a restart resumes with
+the recipients that were not delivered yet instead of starting over.
+Transient failures are retried with exponential backoff; permanent failures
+and recipients that exhaust their attempts are marked as failed.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import DateTime, Integer, String, delete, func, insert, literal, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import AudienceGroupMember, MessageDelivery, ScheduledMessage
+
+# Recipients sent (and committed) per batch. A crash can re-send at most one batch.
+DELIVERY_BATCH_SIZE = int(os.getenv("DELIVERY_BATCH_SIZE", "100"))
+
+# Retry policy for transient failures
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+DELIVERY_RETRY_BASE_SECONDS = float(os.getenv("DELIVERY_RETRY_BASE_SECONDS", "30"))
+DELIVERY_RETRY_MAX_SECONDS = float(os.getenv("DELIVERY_RETRY_MAX_SECONDS", "3600"))
+
+# Rows per INSERT / IN (...) statement
+STATEMENT_CHUNK_SIZE = 500
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff after the given number of failed attempts"""
+    seconds = DELIVERY_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(seconds, DELIVERY_RETRY_MAX_SECONDS))
+
+
+async def create_deliveries(db: AsyncSession, msg: ScheduledMessage) -> None:
+    """
+    Create the pending delivery rows for a message, once.
+
+    All rows are inserted in a single transaction, so either every
+    recipient of a message has a row or none does. Members of a target
+    group are copied straight from the membership table with
+    INSERT ... SELECT, so the group is expanded at delivery time without
+    loading its members into memory.
+    """
+    exists = await db.scalar(select(MessageDelivery.message_id).where(
+        MessageDelivery.message_id == msg.id
+    ).limit(1))
+    if exists:
+        return
+
+    now = datetime.utcnow()
+    user_ids = list(dict.fromkeys(msg.target_user_id or []))
+    for start in range(0, len(user_ids), STATEMENT_CHUNK_SIZE):
+        await db.execute(insert(MessageDelivery), [
+            {
+                "message_id": msg.id,
+                "user_id": user_id,
+                "status": PENDING,
+                "attempts": 0,
+                "updated_at": now
+            }
+            for user_id in user_ids[start:start + STATEMENT_CHUNK_SIZE]
+        ])
+
+    if msg.target_group_id:
+        # Members already listed individually keep their row
+        members = select(
+            literal(msg.id, String()),
+            AudienceGroupMember.user_id,
+            literal(PENDING, String()),
+            literal(0, Integer()),
+            literal(now, DateTime())
+        ).where(
+            AudienceGroupMember.group_id == msg.target_group_id,
+            ~_in_outbox(msg.id, AudienceGroupMember.user_id)
+        )
+        await db.execute(insert(MessageDelivery).from_select(
+            ["message_id", "user_id", "status", "attempts", "updated_at"], members
+        ))
+    await db.commit()
+
+
+def _in_outbox(message_id: str, user_id):
+    return select(MessageDelivery.user_id).where(
+        MessageDelivery.message_id == message_id,
+        MessageDelivery.user_id == user_id
+    ).exists()
+
+
+async def next_delivery_batch(db: AsyncSession, message_id: str, now: datetime) -> Dict[str, int]:
+    """Return up to DELIVERY_BATCH_SIZE pending recipients that are due, with their attempt counts"""
+    result = await db.execute(select(MessageDelivery.user_id, MessageDelivery.attempts).where(
+        MessageDelivery.message_id == message_id,
+        MessageDelivery.status == PENDING,
+        or_(MessageDelivery.next_attempt_at.is_(None), MessageDelivery.next_attempt_at <= now)
+    ).limit(DELIVERY_BATCH_SIZE))
+    return dict(result.all())
+
+
+async def next_retry_time(db: AsyncSession, message_id: str) -> Optional[datetime]:
+    """Earliest retry time of the message's pending recipients, or None if all are settled"""
+    return await db.scalar(select(func.min(MessageDelivery.next_attempt_at)).where(
+        MessageDelivery.message_id == message_id,
+        MessageDelivery.status == PENDING
+    ))
+
+
+async def _update_deliveries(db: AsyncSession, message_id: str, user_ids: List[str], values: dict) -> None:
+    for start in range(0, len(user_ids), STATEMENT_CHUNK_SIZE):
+        await db.execute(update(MessageDelivery).where(
+            MessageDelivery.message_id == message_id,
+            MessageDelivery.user_id.in_(user_ids[start:start + STATEMENT_CHUNK_SIZE])
+        ).values(values).execution_options(synchronize_session=False))
+
+
+async def record_batch_results(db: AsyncSession, message_id: str, batch: Dict[str, int], results: dict) -> None:
+    """
+    Store the outcome of one batch and commit it.
+
+    Recipients that failed transiently, or that send_message_to_users never
+    reported on, are rescheduled with backoff until DELIVERY_MAX_ATTEMPTS.
+    """
+    now = datetime.utcnow()
+    sent = [user_id for user_id in results["success"] if user_id in batch]
+    transient = set(results["transient"])
+    failed = [user_id for user_id in results["failed"] if user_id in batch and user_id not in transient]
+
+    settled = set(sent) | set(failed)
+    retry_by_attempts: Dict[int, List[str]] = {}
+    for user_id, attempts in batch.items():
+        if user_id not in settled:
+            retry_by_attempts.setdefault(attempts + 1, []).append(user_id)
+
+    await _update_deliveries(db, message_id, sent, {
+        MessageDelivery.status: SENT,
+        MessageDelivery.attempts: MessageDelivery.attempts + 1,
+        MessageDelivery.updated_at: now
+    })
+    await _update_deliveries(db, message_id, failed, {
+        MessageDelivery.status: FAILED,
+        MessageDelivery.attempts: MessageDelivery.attempts + 1,
+        MessageDelivery.updated_at: now
+    })
+    for attempts, user_ids in retry_by_attempts.items():
+        if attempts >= DELIVERY_MAX_ATTEMPTS:
+            values = {MessageDelivery.status: FAILED}
+        else:
+            values = {MessageDelivery.next_attempt_at: now + retry_delay(attempts)}
+        values[MessageDelivery.attempts] = attempts
+        values[MessageDelivery.updated_at] = now
+        await _update_deliveries(db, message_id, user_ids, values)
+
+    await db.commit()
+
+
+async def delete_deliveries(db: AsyncSession, message_id: str) -> None:
+    """Remove a message's delivery rows (the caller commits)"""
+    await db.execute(delete(MessageDelivery).where(
+        MessageDelivery.message_id == message_id
+    ).execution_options(synchronize_session=False))
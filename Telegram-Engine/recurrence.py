@@ -0,0 +1,85 @@
+"""
+Recurring schedules - Next-occurrence computation for cron and RRULE expressions.
+
+A recurring message is stored once. Its scheduled_timestamp is the next
+occurrence; when that occurrence has been delivered, the scheduler asks
+for the following one and moves the same row forward instead of the client
+inserting a row per occurrence.
+
+Two expression forms are accepted, both evaluated in UTC:
+- cron, five fields: "0 9 * * MON-FRI"
+- iCalendar RRULE, optionally prefixed with "RRULE:": "FREQ=DAILY;INTERVAL=2;COUNT=10"
+
+RRULEs are anchored at the first occurrence (recurrence_start), so COUNT,
+UNTIL and INTERVAL keep their meaning across occurrences. UNTIL may be
+given in UTC ("UNTIL=20300105T000000Z", the standard form) or as a
+floating time, which is read as UTC too.
+"""
+import re
+from datetime import datetime, timezone
+from typing import Optional
+
+from croniter import croniter
+from dateutil.rrule import rrulestr
+
+
+class InvalidRecurrence(ValueError):
+    """Raised for an expression that is neither a valid cron nor RRULE"""
+
+
+# UNTIL with the UTC designator, e.g. UNTIL=20300105T000000Z
+_UTC_UNTIL = re.compile(r"UNTIL=\d{8}(T\d{6})?Z", re.IGNORECASE)
+
+
+def _is_rrule(expression: str) -> bool:
+    return "FREQ=" in expression.upper()
+
+
+def _is_utc_rule(expression: str) -> bool:
+    """
+    Whether the RRULE has to be evaluated with a timezone-aware anchor.
+
+    dateutil only accepts a UTC UNTIL with a timezone-aware DTSTART, and a
+    floating UNTIL with a naive one.
+    """
+    return bool(_UTC_UNTIL.search(expression))
+
+
+def _rrule(expression: str, start: datetime):
+    """Parse an RRULE anchored at `start` (naive UTC)"""
+    if _is_utc_rule(expression):
+        return rrulestr(expression, dtstart=start.replace(tzinfo=timezone.utc))
+    return rrulestr(expression, dtstart=start)
+
+
+def validate_recurrence(expression: str, start: datetime) -> str:
+    """Check an expression and return it normalised; raises InvalidRecurrence"""
+    expression = expression.strip()
+    if not _is_rrule(expression):
+        # croniter reads a sixth field as seconds, so "0 9 * * * *" would fire every second of 09:00
+        if len(expression.split()) != 5 or not croniter.is_valid(expression):
+            raise InvalidRecurrence(f"Invalid cron expression (expected five fields): {expression}")
+        return expression
+    try:
+        _rrule(expression, start)
+    except (ValueError, TypeError) as e:
+        raise InvalidRecurrence(f"Invalid RRULE '{expression}': {str(e)}")
+    return expression
+
+
+def next_occurrence(expression: str, start: datetime, after: datetime) -> Optional[datetime]:
+    """
+    First occurrence strictly after `after`, or None once the schedule has ended.
+
+    All datetimes are naive UTC. Occurrences missed while the scheduler was
+    down are skipped rather than sent in a burst; pass the current time as
+    `after` for that.
+    """
+    if _is_rrule(expression):
+        rule = _rrule(expression, start)
+        if not _is_utc_rule(expression):
+            return rule.after(after)
+        # Evaluated timezone-aware; results go back to naive UTC
+        occurrence = rule.after(after.replace(tzinfo=timezone.utc))
+        return occurrence.replace(tzinfo=None) if occurrence is not None else None
+    return croniter(expression, after).get_next(datetime)
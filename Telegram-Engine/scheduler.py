@@ -1,13 +1,43 @@
 """
-Message scheduler - Background task that monitors and sends due messages.
+Message scheduler - Background task that sends messages when they become due.
+
+Instead of polling the database on a fixed interval, the scheduler keeps an
+in-process timer queue (a min-heap keyed on scheduled_timestamp). The queue is
+loaded from the database once at startup and is then kept up to date by the
+API, which notifies it whenever a message is scheduled or deleted. The
+background task sleeps exactly until the earliest deadline, or until it is
+woken because the earliest deadline changed.
+
+Each delivery is guarded by a lease (see leases.py), so several scheduler
+workers can run against the same database. Every worker also sweeps the
+database every SCHEDULER_SWEEP_SECONDS for due messages it doesn't know about,
+such as those scheduled through another worker or abandoned by a worker that
+died.
+
+The scheduler can run inside the API process (start_message_scheduler) or as
+its own process (python scheduler.py, started by main.py). In the latter case
+the API sends its notifications to the scheduler as UDP datagrams on
+SCHEDULER_NOTIFY_HOST:SCHEDULER_NOTIFY_PORT; a lost datagram only delays a
+message until the next sweep.
 """
 import asyncio
+import heapq
+import json
 import logging
-from datetime import datetime
-from sqlalchemy.orm import Session
-from database import SessionLocal
+import os
+import signal
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import SessionLocal, init_db
 from models import ScheduledMessage
-from telegram_messenger import send_message_to_users
+from recurrence import next_occurrence
+import leases
+import metrics
+import outbox
+from telegram_messenger import delivery_client, send_message_to_users
 
 # Configure logging
 logging.basicConfig(
@@ -16,61 +46,442 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Delay before retrying a message whose delivery raised an unexpected error
+RETRY_DELAY_SECONDS = 30
+
+# Interval of the backstop sweep for unclaimed or abandoned due messages
+SWEEP_SECONDS = float(os.getenv("SCHEDULER_SWEEP_SECONDS", "60"))
+
+# Maximum messages held in the timer queue. Later messages are paged in, in
+# deadline order, once the queue has drained to half of this.
+QUEUE_CAPACITY = int(os.getenv("SCHEDULER_QUEUE_CAPACITY", "100000"))
+
+# Rows fetched per query when paging unsent messages into the queue
+LOAD_BATCH_SIZE = 1000
+
+# Where a standalone scheduler listens for notifications from the API
+NOTIFY_HOST = os.getenv("SCHEDULER_NOTIFY_HOST", "127.0.0.1")
+NOTIFY_PORT = int(os.getenv("SCHEDULER_NOTIFY_PORT", "8765"))
+# Messages per datagram when a batch is scheduled
+NOTIFY_BATCH_SIZE = 100
+
+
+def _to_naive_utc(value: datetime) -> datetime:
+    """Normalize a datetime to naive UTC, matching how timestamps are stored"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class DueMessageQueue:
+    """
+    Min-heap of (scheduled_timestamp, message_id) pairs.
+
+    Cancelled or rescheduled entries are removed lazily: the heap may contain
+    stale pairs, and only pairs that still match the live deadline in
+    `_deadlines` are considered.
+
+    When not every unsent message fits in the queue, `horizon` is the
+    (scheduled_timestamp, id) of the last one loaded; messages after it are
+    left in the database until the queue is refilled.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, str]] = []
+        self._deadlines: Dict[str, datetime] = {}
+        self._wakeup = asyncio.Event()
+        self.horizon: Optional[Tuple[datetime, str]] = None
+
+    def covers(self, message_id: str, scheduled_timestamp: datetime) -> bool:
+        """Whether a message falls inside the loaded window"""
+        if self.horizon is None:
+            return True
+        return (_to_naive_utc(scheduled_timestamp), message_id) <= self.horizon
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, message_id: str, scheduled_timestamp: datetime) -> None:
+        """Add (or move) a message, waking the scheduler if it is now the earliest"""
+        scheduled_timestamp = _to_naive_utc(scheduled_timestamp)
+        earliest = self.next_deadline()
+
+        self._deadlines[message_id] = scheduled_timestamp
+        heapq.heappush(self._heap, (scheduled_timestamp, message_id))
+        metrics.DUE_QUEUE_DEPTH.set(len(self._deadlines))
+
+        if earliest is None or scheduled_timestamp < earliest:
+            self._wakeup.set()
+
+    def cancel(self, message_id: str) -> None:
+        """Remove a message, waking the scheduler if it was the earliest"""
+        scheduled_timestamp = self._deadlines.pop(message_id, None)
+        if scheduled_timestamp is None:
+            return
+        metrics.DUE_QUEUE_DEPTH.set(len(self._deadlines))
+
+        self._discard_stale()
+        if not self._heap or self._heap[0][0] > scheduled_timestamp:
+            self._wakeup.set()
+
+    def next_deadline(self) -> Optional[datetime]:
+        """Return the earliest pending deadline, or None if the queue is empty"""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> List[str]:
+        """Remove and return the ids of all messages due at or before `now`"""
+        due = []
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, message_id = heapq.heappop(self._heap)
+            del self._deadlines[message_id]
+            due.append(message_id)
+            self._discard_stale()
+        metrics.DUE_QUEUE_DEPTH.set(len(self._deadlines))
+        return due
+
+    async def wait(self, max_wait: Optional[float] = None) -> None:
+        """Sleep until the earliest deadline passes, the queue is changed or `max_wait` elapses"""
+        timeout = max_wait
+        deadline = self.next_deadline()
+        if deadline is not None:
+            until_deadline = (deadline - datetime.utcnow()).total_seconds()
+            if until_deadline <= 0:
+                return
+            timeout = until_deadline if timeout is None else min(timeout, until_deadline)
 
-async def check_and_send_due_messages():
-    """Background task to check for due messages and send them"""
-    while True:
         try:
-            db: Session = SessionLocal()
-            current_time = datetime.utcnow()
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._wakeup.clear()
+
+    def _discard_stale(self) -> None:
+        """Pop heap entries that were cancelled or superseded by a reschedule"""
+        while self._heap:
+            scheduled_timestamp, message_id = self._heap[0]
+            if self._deadlines.get(message_id) == scheduled_timestamp:
+                return
+            heapq.heappop(self._heap)
+
+
+# Process-wide timer queue shared by the API endpoints and the background task
+due_queue = DueMessageQueue()
+
+# True when the scheduler runs inside this process, so notifications can go
+# straight to due_queue instead of over UDP
+_embedded = False
+_notify_socket: Optional[socket.socket] = None
+
+
+def _send_notification(event: dict) -> None:
+    """Best-effort UDP notification to a standalone scheduler process"""
+    global _notify_socket
+    try:
+        if _notify_socket is None:
+            _notify_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            _notify_socket.setblocking(False)
+        _notify_socket.sendto(json.dumps(event).encode("utf-8"), (NOTIFY_HOST, NOTIFY_PORT))
+    except OSError as e:
+        # The sweep will still pick the message up
+        logger.warning(f"Could not notify the scheduler: {str(e)}")
+
+
+def _apply_scheduled(message_id: str, scheduled_timestamp: datetime) -> None:
+    # Messages beyond the loaded window are paged in when the queue is refilled
+    if due_queue.covers(message_id, scheduled_timestamp):
+        due_queue.schedule(message_id, scheduled_timestamp)
+
+
+def notify_message_scheduled(message_id: str, scheduled_timestamp: datetime) -> None:
+    """Called by the API after a message has been committed to the database"""
+    if _embedded:
+        _apply_scheduled(message_id, scheduled_timestamp)
+    else:
+        _send_notification({
+            "event": "scheduled",
+            "id": message_id,
+            "scheduled_timestamp": _to_naive_utc(scheduled_timestamp).isoformat()
+        })
+
+
+def notify_messages_scheduled(messages: List[Tuple[str, datetime]]) -> None:
+    """Called by the API after a batch of messages has been committed to the database"""
+    if _embedded:
+        for message_id, scheduled_timestamp in messages:
+            _apply_scheduled(message_id, scheduled_timestamp)
+        return
+    # Several messages per datagram, well below the UDP payload limit
+    for start in range(0, len(messages), NOTIFY_BATCH_SIZE):
+        _send_notification({
+            "event": "scheduled_batch",
+            "messages": [
+                [message_id, _to_naive_utc(scheduled_timestamp).isoformat()]
+                for message_id, scheduled_timestamp in messages[start:start + NOTIFY_BATCH_SIZE]
+            ]
+        })
+
+
+def notify_message_deleted(message_id: str) -> None:
+    """Called by the API after a message has been removed from the database"""
+    if _embedded:
+        due_queue.cancel(message_id)
+    else:
+        _send_notification({"event": "deleted", "id": message_id})
+
+
+class NotificationProtocol(asyncio.DatagramProtocol):
+    """Receives the API's notifications in a standalone scheduler"""
 
-            # Query for due messages that haven't been sent
-            due_messages = db.query(ScheduledMessage).filter(
-                ScheduledMessage.scheduled_timestamp <= current_time,
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            event = json.loads(data)
+            if event["event"] == "scheduled":
+                _apply_scheduled(event["id"], datetime.fromisoformat(event["scheduled_timestamp"]))
+            elif event["event"] == "scheduled_batch":
+                for message_id, scheduled_timestamp in event["messages"]:
+                    _apply_scheduled(message_id, datetime.fromisoformat(scheduled_timestamp))
+            elif event["event"] == "deleted":
+                due_queue.cancel(event["id"])
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring malformed scheduler notification from {addr}: {str(e)}")
+
+
+async def load_pending_messages() -> int:
+    """
+    Page unsent messages into the timer queue, in deadline order, until it is full.
+
+    Continues after the current horizon, so calling it again refills the
+    queue with the next messages instead of reloading the ones it holds.
+    """
+    loaded = 0
+    async with SessionLocal() as db:
+        while len(due_queue) < QUEUE_CAPACITY:
+            limit = min(LOAD_BATCH_SIZE, QUEUE_CAPACITY - len(due_queue))
+            query = select(ScheduledMessage.id, ScheduledMessage.scheduled_timestamp).where(
                 ScheduledMessage.is_sent == False
-            ).all()
+            )
+            if due_queue.horizon is not None:
+                last_timestamp, last_id = due_queue.horizon
+                query = query.where(or_(
+                    ScheduledMessage.scheduled_timestamp > last_timestamp,
+                    and_(ScheduledMessage.scheduled_timestamp == last_timestamp, ScheduledMessage.id > last_id)
+                ))
+            page = (await db.execute(
+                query.order_by(ScheduledMessage.scheduled_timestamp, ScheduledMessage.id).limit(limit)
+            )).all()
+
+            for message_id, scheduled_timestamp in page:
+                due_queue.schedule(message_id, scheduled_timestamp)
+            loaded += len(page)
+
+            if len(page) < limit:
+                # Everything unsent is in the queue now
+                due_queue.horizon = None
+                break
+            due_queue.horizon = (page[-1].scheduled_timestamp, page[-1].id)
+    return loaded
+
+
+async def send_due_message(db: AsyncSession, message_id: str, lease_token: str) -> None:
+    """
+    Deliver a claimed message through its outbox rows.
+
+    Pending recipients are sent in batches and each batch's outcome is
+    committed, and the lease renewed, before the next one starts. If some
+    recipients are waiting for a retry, the lease is held until the earliest
+    retry time and the message is re-queued for it; once every recipient is
+    sent or permanently failed, the message is marked as sent.
+    """
+    # The claim may be a while old if earlier messages took long to deliver
+    if not await leases.renew_lease(db, message_id, lease_token):
+        return
+
+    msg = await db.get(ScheduledMessage, message_id)
+    if not msg or msg.is_sent:
+        return
+
+    try:
+        logger.info(f"Processing due message {msg.id}")
+        logger.info(f"  Target user_ids: {len(msg.target_user_id)}")
+        logger.info(f"  Scheduled time: {msg.scheduled_timestamp}")
+
+        await outbox.create_deliveries(db, msg)
+
+        while True:
+            batch = await outbox.next_delivery_batch(db, msg.id, datetime.utcnow())
+            if not batch:
+                break
+
+            # Send the message via Telegram
+            results = await send_message_to_users(
+                target_user_ids=list(batch),
+                message=msg.message,
+                file_paths=msg.file_paths
+            )
+
+            # Log results
+            if results["success"]:
+                logger.info(f"Successfully sent to {len(results['success'])} recipient(s)")
+                lateness = (datetime.utcnow() - msg.scheduled_timestamp).total_seconds()
+                for _ in results["success"]:
+                    metrics.DELIVERY_LATENESS.observe(lateness)
+            if results["failed"]:
+                logger.warning(f"Failed to send to: {', '.join(results['failed'])}")
+
+            await outbox.record_batch_results(db, msg.id, batch, results)
+
+            if not await leases.renew_lease(db, msg.id, lease_token):
+                logger.warning(f"Lost the lease on message {msg.id}, leaving it to another worker")
+                return
+
+        retry_at = await outbox.next_retry_time(db, msg.id)
+        if retry_at is not None:
+            await leases.renew_lease(db, msg.id, lease_token, until=retry_at)
+            due_queue.schedule(msg.id, retry_at)
+            logger.info(f"Message {msg.id} has recipients waiting for a retry at {retry_at}")
+            return
+
+        if msg.recurrence and await schedule_next_occurrence(db, msg):
+            return
+
+        msg.is_sent = True
+        msg.lease_token = None
+        msg.lease_expires_at = None
+        await db.commit()
+
+        logger.info(f"Message {msg.id} marked as sent at {datetime.utcnow()}")
 
-            for msg in due_messages:
-                try:
-                    logger.info(f"Processing due message {msg.id}")
-                    logger.info(f"  Target user_ids: {msg.target_user_id}")
-                    logger.info(f"  Scheduled time: {msg.scheduled_timestamp}")
+    except Exception as e:
+        logger.error(f"Error sending message {message_id}: {str(e)}")
+        await db.rollback()
+        await leases.release_lease(db, message_id, lease_token)
+        due_queue.schedule(message_id, datetime.utcnow() + timedelta(seconds=RETRY_DELAY_SECONDS))
 
-                    # Send the message via Telegram
-                    results = await send_message_to_users(
-                        target_user_ids=msg.target_user_id,
-                        message=msg.message,
-                        file_paths=msg.file_paths
-                    )
 
-                    # Log results
-                    if results["success"]:
-                        logger.info(f"Successfully sent to: {', '.join(results['success'])}")
-                    if results["failed"]:
-                        logger.warning(f"Failed to send to: {', '.join(results['failed'])}")
+async def schedule_next_occurrence(db: AsyncSession, msg: ScheduledMessage) -> bool:
+    """
+    Move a recurring message to its next occurrence once the current one is delivered.
 
-                    # Mark as sent (even if some failed, we don't retry)
-                    msg.is_sent = True
-                    db.commit()
+    The same row is reused: its deliveries are cleared, scheduled_timestamp
+    is advanced and it goes back into the due queue. Returns False when the
+    recurrence has ended, so the message is marked as sent instead.
+    """
+    next_at = next_occurrence(
+        msg.recurrence,
+        msg.recurrence_start or msg.scheduled_timestamp,
+        max(msg.scheduled_timestamp, datetime.utcnow())
+    )
+    if next_at is None:
+        return False
 
-                    logger.info(f"Message {msg.id} marked as sent at {datetime.utcnow()}")
+    await outbox.delete_deliveries(db, msg.id)
+    msg.scheduled_timestamp = next_at
+    msg.lease_token = None
+    msg.lease_expires_at = None
+    await db.commit()
 
-                except Exception as e:
-                    logger.error(f"Error sending message {msg.id}: {str(e)}")
-                    db.rollback()
+    _apply_scheduled(msg.id, next_at)
+    logger.info(f"Recurring message {msg.id} rescheduled for {next_at}")
+    return True
 
-            db.close()
+
+async def check_and_send_due_messages():
+    """Background task that sleeps until the next deadline and sends due messages"""
+    next_sweep = datetime.utcnow()
+    while True:
+        try:
+            if due_queue.horizon is not None and len(due_queue) < QUEUE_CAPACITY // 2:
+                await load_pending_messages()
+
+            await due_queue.wait(max_wait=max((next_sweep - datetime.utcnow()).total_seconds(), 0))
+
+            now = datetime.utcnow()
+            due_ids = due_queue.pop_due(now)
+            sweep = now >= next_sweep
+            if not due_ids and not sweep:
+                continue
+
+            async with SessionLocal() as db:
+                claims = []
+                for start in range(0, len(due_ids), leases.CLAIM_BATCH_SIZE):
+                    # Messages another worker already holds are simply dropped here
+                    claims.append(await leases.claim_messages(
+                        db, now, due_ids[start:start + leases.CLAIM_BATCH_SIZE]
+                    ))
+                if sweep:
+                    claims.append(await leases.claim_messages(db, now))
+                    next_sweep = now + timedelta(seconds=SWEEP_SECONDS)
+
+                for lease_token, message_ids in claims:
+                    for message_id in message_ids:
+                        await send_due_message(db, message_id, lease_token)
 
         except Exception as e:
             logger.error(f"Error in background task: {str(e)}")
-
-        # Check every 5 seconds
-        await asyncio.sleep(5)
+            await asyncio.sleep(1)
 
 
 def start_message_scheduler(app):
-    """Start the background message scheduler"""
+    """Run the message scheduler inside the API process"""
     @app.on_event("startup")
     async def start_scheduler():
-        asyncio.create_task(check_and_send_due_messages())
-        logger.info("Message scheduler started! Checking for due messages every 5 seconds...")
+        global _embedded
+        _embedded = True
+        await delivery_client.start()
+        count = await load_pending_messages()
+        app.state.scheduler_task = asyncio.create_task(check_and_send_due_messages())
+        logger.info(f"Message scheduler started with {count} pending message(s) queued")
+
+    @app.on_event("shutdown")
+    async def stop_scheduler():
+        app.state.scheduler_task.cancel()
+        await delivery_client.stop()
+
+
+async def run_scheduler():
+    """Run the message scheduler as a standalone process until it is stopped"""
+    global _embedded
+    _embedded = True
+    await init_db()
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    transport = None
+    try:
+        transport, _ = await loop.create_datagram_endpoint(
+            NotificationProtocol, local_addr=(NOTIFY_HOST, NOTIFY_PORT)
+        )
+        logger.info(f"Listening for API notifications on {NOTIFY_HOST}:{NOTIFY_PORT}")
+    except OSError as e:
+        # e.g. a second scheduler on this host; leases and sweeps keep it correct
+        logger.warning(f"Not listening for API notifications ({str(e)}), relying on sweeps")
+
+    metrics.start_metrics_server()
+    await delivery_client.start()
+    count = await load_pending_messages()
+    task = asyncio.create_task(check_and_send_due_messages())
+    logger.info(f"Message scheduler started with {count} pending message(s) queued")
+
+    try:
+        await stop.wait()
+    finally:
+        task.cancel()
+        if transport is not None:
+            transport.close()
+        await delivery_client.stop()
+        logger.info("Message scheduler stopped")
+
+
+def main() -> None:
+    """Start the standalone message scheduler."""
+    asyncio.run(run_scheduler())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator, model_validator
 from typing import List, Optional
 from datetime import datetime
 
@@ -11,15 +11,56 @@ class ScheduleMessageResponse(BaseModel):
     id: str
     from_sender: str
     target_user_id: List[str]
+    target_group_id: Optional[str] = None
     message: str
     scheduled_timestamp: datetime
     file_paths: Optional[List[str]] = None
+    recurrence: Optional[str] = None
     is_sent: bool
     created_at: datetime
 
     class Config:
         from_attributes = True
 
+class BulkScheduleMessage(BaseModel):
+    from_sender: str
+    target_user_id: List[str] = []
+    target_group_id: Optional[str] = None
+    message: str
+    scheduled_timestamp: datetime  # UTC timestamp (ISO 8601), the first occurrence if recurring
+    recurrence: Optional[str] = None  # cron or RRULE
+
+    @field_validator("target_user_id", mode="before")
+    @classmethod
+    def split_user_ids(cls, value):
+        # Same comma-separated form as /schedule-message
+        if isinstance(value, str):
+            return [uid.strip() for uid in value.split(",") if uid.strip()]
+        return value
+
+    @model_validator(mode="after")
+    def require_recipients(self):
+        if not self.target_user_id and not self.target_group_id:
+            raise ValueError("target_user_id or target_group_id is required")
+        return self
+
+class BulkScheduleResponse(BaseModel):
+    ids: List[str]
+    count: int
+
+class GroupCreateRequest(BaseModel):
+    name: str
+    user_ids: List[str] = []
+
+class GroupMembersRequest(BaseModel):
+    user_ids: List[str]
+
+class GroupResponse(BaseModel):
+    group_id: str
+    name: str
+    member_count: int
+    created_at: datetime
+
 class SubscribeUserRequest(BaseModel):
     chat_id: str
     chat_name: str
@@ -33,6 +74,14 @@ class SubscribeUserResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SubscribeUserResult(SubscribeUserResponse):
+    created: bool  # False when the chat was already subscribed
+
+class SubscriberImportResponse(BaseModel):
+    received: int
+    imported: int
+    existing: int
+
 class Token(BaseModel):
     access_token: str
     token_type: str
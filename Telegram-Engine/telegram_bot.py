@@ -1,6 +1,8 @@
 import os
 import logging
-import requests
+from typing import Optional
+import httpx
+from fastapi import FastAPI, HTTPException, Request
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 from dotenv import load_dotenv
@@ -19,10 +21,52 @@ logger = logging.getLogger(__name__)
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
 
+# Bot API endpoint; point it at a local fake server for testing
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+
+# Webhook mode: Telegram pushes updates to the API instead of the bot polling.
+# TELEGRAM_WEBHOOK_URL is the public HTTPS URL that routes to WEBHOOK_PATH.
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_PATH = "/telegram/webhook"
+
+# Only the update types the handlers use are requested from Telegram
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+# Updates handled in parallel, e.g. a burst of /start after a promotion
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "64"))
+# Keep-alive connections from the bot to the API
+BOT_API_MAX_CONNECTIONS = int(os.getenv("BOT_API_MAX_CONNECTIONS", "20"))
+BOT_API_TIMEOUT_SECONDS = float(os.getenv("BOT_API_TIMEOUT_SECONDS", "10"))
+
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable is not set!")
 
 
+# Pooled client for calls to the API, opened and closed with the application
+api_client: Optional[httpx.AsyncClient] = None
+
+
+async def open_api_client(application: Application) -> None:
+    global api_client
+    api_client = httpx.AsyncClient(
+        base_url=API_BASE_URL,
+        timeout=BOT_API_TIMEOUT_SECONDS,
+        limits=httpx.Limits(
+            max_connections=BOT_API_MAX_CONNECTIONS,
+            max_keepalive_connections=BOT_API_MAX_CONNECTIONS
+        )
+    )
+
+
+async def close_api_client(application: Application) -> None:
+    global api_client
+    if api_client is not None:
+        await api_client.aclose()
+        api_client = None
+
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handle the /start command.
@@ -39,17 +83,26 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     logger.info(f"Received /start from chat_id: {chat_id}, name: {chat_name}")
 
     try:
-        # Call the API to subscribe the user
-        response = requests.post(
-            f"{API_BASE_URL}/subscribe-user",
+        # Call the API to subscribe the user, without blocking other updates
+        response = await api_client.post(
+            "/subscribe-user",
             json={
                 "chat_id": chat_id,
                 "chat_name": chat_name
-            },
-            timeout=10
+            }
         )
 
-        if response.status_code == 200:
+        if response.status_code == 200 and not response.json().get('created', True):
+            # The chat was already subscribed
+            await update.message.reply_text(
+                f"Welcome back, {chat_name}!\n\n"
+                f"You are already subscribed to receive messages.\n"
+                f"Your Chat ID: `{chat_id}`",
+                parse_mode='Markdown'
+            )
+            logger.info(f"User already subscribed: {chat_id}")
+
+        elif response.status_code == 200:
             data = response.json()
             user_id = data['user_id']
 
@@ -64,23 +117,12 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             logger.info(f"Successfully subscribed user: {chat_id} with user_id: {user_id}")
 
         elif response.status_code == 400:
-            # User already exists
-            error_detail = response.json().get('detail', 'User already exists')
-
-            if "already exists" in error_detail:
-                await update.message.reply_text(
-                    f"Welcome back, {chat_name}!\n\n"
-                    f"You are already subscribed to receive messages.\n"
-                    f"Your Chat ID: `{chat_id}`",
-                    parse_mode='Markdown'
-                )
-                logger.info(f"User already subscribed: {chat_id}")
-            else:
-                await update.message.reply_text(
-                    f"Error: {error_detail}\n\n"
-                    f"Please contact support if this issue persists."
-                )
-                logger.error(f"Subscription error for {chat_id}: {error_detail}")
+            error_detail = response.json().get('detail', 'Invalid request')
+            await update.message.reply_text(
+                f"Error: {error_detail}\n\n"
+                f"Please contact support if this issue persists."
+            )
+            logger.error(f"Subscription error for {chat_id}: {error_detail}")
         else:
             await update.message.reply_text(
                 f"L Oops! Something went wrong while subscribing you.\n"
@@ -89,14 +131,14 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             )
             logger.error(f"Subscription failed for {chat_id}: HTTP {response.status_code}")
 
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         await update.message.reply_text(
             "L Cannot connect to the server.\n"
             "Please make sure the API server is running and try again."
         )
         logger.error(f"Connection error: Cannot reach API at {API_BASE_URL}")
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         await update.message.reply_text(
             "Request timed out.\n"
             "The server is taking too long to respond. Please try again."
@@ -123,20 +165,79 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
 
-def main() -> None:
-    """Start the Telegram bot."""
-    logger.info("Starting Telegram bot...")
-
-    # Create the Application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+def build_application() -> Application:
+    """Create the bot application with its command handlers registered"""
+    # Updates are processed concurrently, so the Bot API connection pool is
+    # sized to match
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .base_url(TELEGRAM_API_BASE_URL)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .connection_pool_size(BOT_CONCURRENT_UPDATES)
+        .post_init(open_api_client)
+        .post_shutdown(close_api_client)
+        .build()
+    )
 
     # Register command handlers
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
+    return application
+
+
+def start_webhook(app: FastAPI) -> None:
+    """
+    Serve the bot from the FastAPI app in webhook mode.
+
+    Every API worker registers the webhook on startup (idempotent) and
+    handles the updates POSTed to WEBHOOK_PATH. Workers keep no state
+    between updates, so any number of them can sit behind a load balancer.
+    An update is acknowledged only after it has been handled, so Telegram
+    redelivers it if a worker fails.
+    """
+    application = build_application()
+
+    @app.on_event("startup")
+    async def start_bot_webhook():
+        await application.initialize()
+        await open_api_client(application)
+        await application.bot.set_webhook(
+            url=TELEGRAM_WEBHOOK_URL,
+            allowed_updates=ALLOWED_UPDATES,
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+            max_connections=TELEGRAM_WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"Telegram webhook registered at {TELEGRAM_WEBHOOK_URL}")
+
+    @app.on_event("shutdown")
+    async def stop_bot_webhook():
+        # The webhook stays registered for the other workers
+        await close_api_client(application)
+        await application.shutdown()
+
+    @app.post(WEBHOOK_PATH, include_in_schema=False)
+    async def telegram_webhook(request: Request):
+        if TELEGRAM_WEBHOOK_SECRET and \
+                request.headers.get("X-Telegram-Bot-Api-Secret-Token") != TELEGRAM_WEBHOOK_SECRET:
+            raise HTTPException(status_code=403, detail="Invalid webhook secret")
+        update = Update.de_json(await request.json(), application.bot)
+        await application.process_update(update)
+        return {"ok": True}
+
+
+def main() -> None:
+    """Start the Telegram bot in polling mode."""
+    if TELEGRAM_WEBHOOK_URL:
+        logger.info("TELEGRAM_WEBHOOK_URL is set; updates are received by the API, not by polling")
+        return
+
+    logger.info("Starting Telegram bot...")
+    application = build_application()
 
     # Start the Bot
     logger.info("Bot is running. Press Ctrl+C to stop.")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == '__main__':
@@ -2,16 +2,24 @@
 Telegram messenger - Handles message delivery via Telegram Bot API.
 """
 import os
+import time
+import uuid
 import logging
 import asyncio
-from typing import List, Optional
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Union
 from pathlib import Path
-from telegram import Bot
-from telegram.error import TelegramError
+import httpx
+from telegram import Bot, InputFile
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
-from database import SessionLocal
-from models import SubscribedUser
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import SessionLocal, engine
+from models import Attachment, SubscribedUser
+import metrics
 
 load_dotenv()
 
@@ -22,49 +30,380 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable is not set!")
 
+# Bot API endpoint; point it at a local fake server for testing
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
 
-async def send_telegram_message(
+# Delivery limits. Telegram allows roughly 30 messages per second per bot and
+# about one message per second to the same chat.
+MAX_CONCURRENT_SENDS = int(os.getenv("TELEGRAM_MAX_CONCURRENT_SENDS", "50"))
+GLOBAL_RATE_LIMIT = float(os.getenv("TELEGRAM_GLOBAL_RATE_LIMIT", "30"))
+PER_CHAT_RATE_LIMIT = float(os.getenv("TELEGRAM_PER_CHAT_RATE_LIMIT", "1"))
+MAX_RETRY_AFTER_ATTEMPTS = int(os.getenv("TELEGRAM_MAX_RETRY_AFTER_ATTEMPTS", "3"))
+
+# HTTP connection pool shared by every delivery
+CONNECTION_POOL_SIZE = int(os.getenv("TELEGRAM_CONNECTION_POOL_SIZE", "64"))
+KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("TELEGRAM_KEEPALIVE_EXPIRY_SECONDS", "60"))
+POOL_TIMEOUT_SECONDS = float(os.getenv("TELEGRAM_POOL_TIMEOUT_SECONDS", "10"))
+
+# Maximum number of user_id -> chat_id mappings kept in memory
+SUBSCRIBER_CACHE_SIZE = int(os.getenv("SUBSCRIBER_CACHE_SIZE", "100000"))
+# Maximum number of attachment file_ids kept in memory; misses are reloaded
+# from attachments.telegram_file_id
+FILE_ID_CACHE_SIZE = int(os.getenv("FILE_ID_CACHE_SIZE", "10000"))
+
+# user_ids per IN (...) lookup, kept well below SQLite's bound-parameter limit
+CHAT_ID_LOOKUP_CHUNK_SIZE = 500
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations instead of holding a lock.
+
+    Tokens may go negative: each caller reserves one token immediately and
+    sleeps until the bucket would have refilled to cover it, so concurrent
+    callers are spaced out at `rate` per second in arrival order.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        """Wait until one token is available and consume it"""
+        self._refill()
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class RateLimiter:
+    """Global messages-per-second cap combined with a per-chat cap"""
+
+    # Idle per-chat buckets are dropped once this many are being tracked
+    MAX_TRACKED_CHATS = 10000
+
+    def __init__(self, global_rate: float, per_chat_rate: float):
+        self.per_chat_rate = per_chat_rate
+        self._global = TokenBucket(global_rate)
+        self._chats: Dict[str, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_TRACKED_CHATS:
+                # A full bucket behaves exactly like a new one, so it is safe to forget
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.is_full}
+            bucket = TokenBucket(self.per_chat_rate, capacity=1.0)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: str) -> None:
+        """Wait for both the chat's and the bot's budget to allow one request"""
+        await self._chat_bucket(chat_id).acquire()
+        await self._global.acquire()
+
+
+rate_limiter = RateLimiter(GLOBAL_RATE_LIMIT, PER_CHAT_RATE_LIMIT)
+
+
+async def _timed_call(method, **kwargs):
+    """Call a Bot API method, recording its latency"""
+    started = time.perf_counter()
+    try:
+        return await method(**kwargs)
+    finally:
+        metrics.API_CALL_DURATION.labels(method.__name__).observe(time.perf_counter() - started)
+
+
+async def _rate_limited_call(chat_id: str, method, build_kwargs: Optional[Callable[[], dict]] = None, **kwargs):
+    """
+    Call a Bot API method once the rate limiter allows it.
+
+    If Telegram still answers with 429 (RetryAfter), wait the requested time
+    and try again, up to MAX_RETRY_AFTER_ATTEMPTS times. Arguments that are
+    consumed by a request, such as uploaded files, come from `build_kwargs`,
+    which is called again for every attempt.
+    """
+    for attempt in range(MAX_RETRY_AFTER_ATTEMPTS + 1):
+        await rate_limiter.acquire(chat_id)
+        attempt_kwargs = {**kwargs, **build_kwargs()} if build_kwargs is not None else kwargs
+        try:
+            return await _timed_call(method, chat_id=chat_id, **attempt_kwargs)
+        except RetryAfter as e:
+            if attempt == MAX_RETRY_AFTER_ATTEMPTS:
+                raise
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            logger.warning(f"Rate limited by Telegram for chat_id {chat_id}, retrying in {retry_after}s")
+            await asyncio.sleep(retry_after)
+
+
+class DeliveryClient:
+    """
+    Long-lived Bot whose HTTP connections are pooled and kept alive.
+
+    Created once by the scheduler on startup and shut down with the app, so
+    each delivery is a single request on an already-open connection instead
+    of a fresh client, TCP connect and TLS handshake per recipient.
+    """
+
+    def __init__(self):
+        self._request: Optional[HTTPXRequest] = None
+        self._bot: Optional[Bot] = None
+
+    async def start(self) -> Bot:
+        """Open the connection pool (no-op if it is already open)"""
+        if self._bot is None:
+            request = HTTPXRequest(
+                connection_pool_size=CONNECTION_POOL_SIZE,
+                pool_timeout=POOL_TIMEOUT_SECONDS,
+                httpx_kwargs={
+                    "limits": httpx.Limits(
+                        max_connections=CONNECTION_POOL_SIZE,
+                        max_keepalive_connections=CONNECTION_POOL_SIZE,
+                        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS
+                    )
+                }
+            )
+            await request.initialize()
+
+            # The delivery bot never polls, so updates share the same pool
+            self._request = request
+            self._bot = Bot(
+                token=TELEGRAM_BOT_TOKEN,
+                base_url=TELEGRAM_API_BASE_URL,
+                request=request,
+                get_updates_request=request
+            )
+            logger.info(f"Telegram delivery client started (pool size {CONNECTION_POOL_SIZE})")
+        return self._bot
+
+    async def stop(self) -> None:
+        """Close every pooled connection"""
+        if self._request is not None:
+            await self._request.shutdown()
+            logger.info("Telegram delivery client stopped")
+        self._request = None
+        self._bot = None
+
+    async def get_bot(self) -> Bot:
+        """Return the shared Bot, starting the client on first use"""
+        return await self.start()
+
+
+# Process-wide delivery client, started and stopped by the scheduler
+delivery_client = DeliveryClient()
+
+
+class FileIdCache:
+    """
+    Bounded LRU cache of attachment path -> Telegram file_id.
+
+    file_ids are persisted in attachments.telegram_file_id, so an evicted
+    entry only costs a database lookup in load_file_ids(), and entries of
+    deleted attachments age out instead of piling up.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, file_path: str) -> bool:
+        return file_path in self._entries
+
+    def get(self, file_path: str) -> Optional[str]:
+        file_id = self._entries.get(file_path)
+        if file_id is not None:
+            self._entries.move_to_end(file_path)
+        return file_id
+
+    def put(self, file_path: str, file_id: str) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[file_path] = file_id
+        self._entries.move_to_end(file_path)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, file_path: str, file_id: str) -> None:
+        """Forget file_path's file_id, unless it was replaced meanwhile"""
+        if self._entries.get(file_path) == file_id:
+            del self._entries[file_path]
+
+
+# Telegram file_ids of recently sent attachments, keyed by local path. A
+# file_id can be reused by the same bot for any chat, so each file only has
+# to be uploaded once.
+_file_ids = FileIdCache(FILE_ID_CACHE_SIZE)
+# Held while a file is being uploaded; only exists during the upload
+_upload_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def load_file_ids(db: AsyncSession, file_paths: List[str]) -> None:
+    """Pull previously persisted file_ids for these attachments into memory"""
+    missing = [file_path for file_path in file_paths if file_path not in _file_ids]
+    if not missing:
+        return
+
+    try:
+        result = await db.execute(select(Attachment.file_path, Attachment.telegram_file_id).where(
+            Attachment.file_path.in_(missing),
+            Attachment.telegram_file_id.isnot(None)
+        ))
+        for file_path, file_id in result.all():
+            _file_ids.put(file_path, file_id)
+    except Exception as e:
+        logger.error(f"Error loading file_ids for attachments: {str(e)}")
+
+
+async def save_file_id(file_path: str, file_id: str) -> None:
+    """Persist the file_id Telegram assigned to an uploaded attachment"""
+    async with SessionLocal() as db:
+        try:
+            # Only files still referenced by a message have a row to update
+            await db.execute(
+                update(Attachment)
+                .where(Attachment.file_path == file_path)
+                .values(telegram_file_id=file_id)
+            )
+            await db.commit()
+        except Exception as e:
+            logger.error(f"Error saving file_id for {file_path}: {str(e)}")
+            await db.rollback()
+
+
+async def send_attachment(bot: Bot, chat_id: str, file_path: str) -> None:
+    """
+    Send one attachment, uploading it only if Telegram doesn't have it yet.
+
+    The first sender of a file uploads the bytes while holding a per-file lock
+    and records the returned file_id; concurrent senders wait for it and then
+    send by file_id.
+    """
+    file_id = _file_ids.get(file_path)
+
+    if file_id is None:
+        lock = _upload_locks.setdefault(file_path, asyncio.Lock())
+        try:
+            async with lock:
+                file_id = _file_ids.get(file_path)
+                if file_id is None:
+                    path = Path(file_path)
+                    if not (path.exists() and path.is_file()):
+                        logger.error(f"File not found: {file_path}")
+                        return
+
+                    # Send file directly from local path, read afresh for every attempt
+                    sent = await _rate_limited_call(
+                        chat_id, bot.send_document,
+                        build_kwargs=lambda: {"document": InputFile(path.read_bytes(), filename=path.name)}
+                    )
+
+                    _file_ids.put(file_path, sent.document.file_id)
+                    await save_file_id(file_path, sent.document.file_id)
+                    logger.info(f"File uploaded to chat_id {chat_id}: {path.name}")
+                    return
+        finally:
+            # Senders still waiting hold the lock object itself; later ones
+            # find the file_id (or start a new upload after a failure)
+            if _upload_locks.get(file_path) is lock:
+                del _upload_locks[file_path]
+
+    try:
+        await _rate_limited_call(chat_id, bot.send_document, document=file_id)
+    except BadRequest as e:
+        if "file" not in str(e).lower():
+            raise
+        # The stored file_id was rejected, so forget it and upload again
+        _file_ids.discard(file_path, file_id)
+        await send_attachment(bot, chat_id, file_path)
+        return
+    logger.info(f"File sent to chat_id {chat_id} by file_id: {file_path}")
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Whether a failed delivery is worth retrying later.
+
+    Network problems, timeouts and rate limiting are transient. Telegram
+    rejecting the request itself (blocked bot, unknown chat, bad payload) is
+    not; PTB reports those as BadRequest/Forbidden and friends.
+    """
+    if isinstance(error, RetryAfter):
+        return True
+    if isinstance(error, NetworkError):
+        return not isinstance(error, BadRequest)
+    return not isinstance(error, TelegramError)
+
+
+async def deliver_to_chat(
     chat_id: str,
     message: str,
     file_paths: Optional[List[str]] = None
-) -> bool:
+) -> None:
     """
-    Send a message to a specific Telegram chat.
+    Send a message and its attachments to a chat, raising if the text fails.
 
-    Args:
-        chat_id: The Telegram chat ID
-        message: The message text to send
-        file_paths: Optional list of local file paths to attach
-
-    Returns:
-        bool: True if message was sent successfully, False otherwise
+    Attachment failures are logged but don't fail the delivery.
     """
-    try:
-        bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    bot = await delivery_client.get_bot()
+    started = time.perf_counter()
 
+    try:
         # Send the text message
-        await bot.send_message(chat_id=chat_id, text=message)
+        await _rate_limited_call(chat_id, bot.send_message, text=message)
         logger.info(f"Message sent to chat_id: {chat_id}")
 
         # Send files if any
         if file_paths:
             for file_path in file_paths:
                 try:
-                    # Send file directly from local path
-                    path = Path(file_path)
-
-                    if path.exists() and path.is_file():
-                        with open(path, 'rb') as file:
-                            await bot.send_document(
-                                chat_id=chat_id,
-                                document=file
-                            )
-                        logger.info(f"File sent to chat_id {chat_id}: {path.name}")
-                    else:
-                        logger.error(f"File not found: {file_path}")
+                    await send_attachment(bot, chat_id, file_path)
                 except Exception as e:
                     logger.error(f"Error sending file {file_path} to {chat_id}: {str(e)}")
+    except Exception as e:
+        metrics.SEND_FAILURES.labels(type(e).__name__).inc()
+        raise
+    else:
+        metrics.MESSAGES_SENT.inc()
+    finally:
+        metrics.SEND_DURATION.observe(time.perf_counter() - started)
+
+
+async def send_telegram_message(
+    chat_id: str,
+    message: str,
+    file_paths: Optional[List[str]] = None
+) -> bool:
+    """
+    Send a message to a specific Telegram chat.
 
+    Args:
+        chat_id: The Telegram chat ID
+        message: The message text to send
+        file_paths: Optional list of local file paths to attach
+
+    Returns:
+        bool: True if message was sent successfully, False otherwise
+    """
+    try:
+        await deliver_to_chat(chat_id, message, file_paths)
         return True
 
     except TelegramError as e:
@@ -75,7 +414,106 @@ async def send_telegram_message(
         return False
 
 
-def get_chat_id_from_user_id(db: Session, user_id: str) -> Optional[str]:
+class SubscriberCache:
+    """
+    Bounded LRU cache of user_id -> chat_id.
+
+    Subscriptions are insert-only and a user_id never changes its chat_id, so
+    entries never go stale; the API adds new subscribers as they are created
+    and misses simply fall through to the database. To keep the footprint
+    small for large subscriber bases, canonical UUID keys are packed into
+    16 bytes and numeric chat_ids are stored as ints.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Union[bytes, str], Union[int, str]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @staticmethod
+    def _pack_user_id(user_id: str) -> Union[bytes, str]:
+        try:
+            packed = uuid.UUID(user_id)
+        except ValueError:
+            return user_id
+        # Only pack canonical strings so unpacking gives back the same user_id
+        return packed.bytes if str(packed) == user_id else user_id
+
+    @staticmethod
+    def _pack_chat_id(chat_id: str) -> Union[int, str]:
+        try:
+            packed = int(chat_id)
+        except ValueError:
+            return chat_id
+        return packed if str(packed) == chat_id else chat_id
+
+    def get(self, user_id: str) -> Optional[str]:
+        key = self._pack_user_id(user_id)
+        chat_id = self._entries.get(key)
+        if chat_id is None:
+            return None
+        self._entries.move_to_end(key)
+        return str(chat_id)
+
+    def put(self, user_id: str, chat_id: str) -> None:
+        if self.max_size <= 0:
+            return
+        key = self._pack_user_id(user_id)
+        self._entries[key] = self._pack_chat_id(chat_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+# Process-wide subscriber cache, shared by the scheduler and the API
+subscriber_cache = SubscriberCache(SUBSCRIBER_CACHE_SIZE)
+
+
+async def get_chat_ids_for_user_ids(db: AsyncSession, user_ids: Iterable[str]) -> Dict[str, str]:
+    """
+    Resolve many user_ids to chat_ids at once.
+
+    Cached mappings are used directly; the rest are fetched with one
+    IN (...) query per CHAT_ID_LOOKUP_CHUNK_SIZE user_ids.
+
+    Args:
+        db: Database session
+        user_ids: The randomly generated user_ids
+
+    Returns:
+        dict: chat_id keyed by user_id, for every user_id that was found
+
+    Database errors propagate: a user_id that could not be looked up is not
+    the same as one that isn't subscribed.
+    """
+    resolved = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        chat_id = subscriber_cache.get(user_id)
+        if chat_id is not None:
+            resolved[user_id] = chat_id
+        else:
+            missing.append(user_id)
+
+    for start in range(0, len(missing), CHAT_ID_LOOKUP_CHUNK_SIZE):
+        chunk = missing[start:start + CHAT_ID_LOOKUP_CHUNK_SIZE]
+        result = await db.execute(select(SubscribedUser.user_id, SubscribedUser.chat_id).where(
+            SubscribedUser.user_id.in_(chunk)
+        ))
+
+        for user_id, chat_id in result.all():
+            resolved[user_id] = chat_id
+            subscriber_cache.put(user_id, chat_id)
+
+    return resolved
+
+
+async def get_chat_id_from_user_id(db: AsyncSession, user_id: str) -> Optional[str]:
     """
     Look up chat_id from user_id in the subscribed_users table.
 
@@ -86,20 +524,10 @@ def get_chat_id_from_user_id(db: Session, user_id: str) -> Optional[str]:
     Returns:
         str: The chat_id if found, None otherwise
     """
-    try:
-        user = db.query(SubscribedUser).filter(
-            SubscribedUser.user_id == user_id
-        ).first()
-
-        if user:
-            return user.chat_id
-        else:
-            logger.warning(f"No subscribed user found with user_id: {user_id}")
-            return None
-
-    except Exception as e:
-        logger.error(f"Error looking up chat_id for user_id {user_id}: {str(e)}")
-        return None
+    chat_id = (await get_chat_ids_for_user_ids(db, [user_id])).get(user_id)
+    if chat_id is None:
+        logger.warning(f"No subscribed user found with user_id: {user_id}")
+    return chat_id
 
 
 async def send_message_to_users(
@@ -110,43 +538,76 @@ async def send_message_to_users(
     """
     Send a message to multiple users by their user_ids.
 
+    Recipients are delivered concurrently by up to MAX_CONCURRENT_SENDS
+    workers, paced by the global and per-chat rate limits.
+
     Args:
         target_user_ids: List of user_ids to send to
         message: The message text to send
         file_paths: Optional list of local file paths to attach
 
     Returns:
-        dict: Summary of results with 'success' and 'failed' lists
+        dict: Summary of results with 'success' and 'failed' lists. The
+            'transient' list holds the subset of 'failed' whose error is
+            worth retrying (see is_transient_error).
     """
-    db = SessionLocal()
     results = {
         "success": [],
-        "failed": []
+        "failed": [],
+        "transient": []
     }
 
     try:
+        async with SessionLocal() as db:
+            # Resolve every recipient before fanning out
+            chat_ids = await get_chat_ids_for_user_ids(db, target_user_ids)
+
+            if file_paths:
+                await load_file_ids(db, file_paths)
+
+        deliveries = []
         for user_id in target_user_ids:
-            # Look up chat_id from user_id
-            chat_id = get_chat_id_from_user_id(db, user_id)
+            chat_id = chat_ids.get(user_id)
 
             if chat_id:
-                # Send message
-                success = await send_telegram_message(chat_id, message, file_paths)
-
-                if success:
-                    results["success"].append(user_id)
-                    logger.info(f"Successfully sent message to user_id: {user_id} (chat_id: {chat_id})")
-                else:
-                    results["failed"].append(user_id)
-                    logger.error(f"Failed to send message to user_id: {user_id} (chat_id: {chat_id})")
+                deliveries.append((user_id, chat_id))
             else:
                 results["failed"].append(user_id)
+                metrics.SEND_FAILURES.labels("UnknownRecipient").inc()
                 logger.error(f"No chat_id found for user_id: {user_id}")
+    except Exception as e:
+        # Nothing is reported, so the whole batch is retried with backoff
+        logger.error(f"Error resolving recipients in send_message_to_users: {str(e)}")
+        return results
+
+    # None means sent, otherwise the exception that failed the delivery
+    not_attempted = NetworkError("Delivery was not attempted")
+    outcomes: List[Optional[Exception]] = [not_attempted] * len(deliveries)
+    pending = iter(enumerate(deliveries))
+
+    async def worker():
+        # Workers share one iterator, so at most MAX_CONCURRENT_SENDS sends are in flight
+        for index, (user_id, chat_id) in pending:
+            try:
+                await deliver_to_chat(chat_id, message, file_paths)
+                outcomes[index] = None
+                logger.info(f"Successfully sent message to user_id: {user_id} (chat_id: {chat_id})")
+            except Exception as e:
+                outcomes[index] = e
+                logger.error(f"Failed to send message to user_id: {user_id} (chat_id: {chat_id}): {str(e)}")
 
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(MAX_CONCURRENT_SENDS, len(deliveries)))))
     except Exception as e:
         logger.error(f"Error in send_message_to_users: {str(e)}")
-    finally:
-        db.close()
+
+    for (user_id, _), error in zip(deliveries, outcomes):
+        if error is None:
+            results["success"].append(user_id)
+        else:
+            results["failed"].append(user_id)
+            if is_transient_error(error):
+                results["transient"].append(user_id)
 
     return results
 
@@ -167,4 +628,12 @@ def send_message_sync(
     Returns:
         dict: Summary of results with 'success' and 'failed' lists
     """
-    return asyncio.run(send_message_to_users(target_user_ids, message, file_paths))
+    async def send_and_close():
+        # The pooled connections belong to this event loop, so close them with it
+        try:
+            return await send_message_to_users(target_user_ids, message, file_paths)
+        finally:
+            await delivery_client.stop()
+            await engine.dispose()
+
+    return asyncio.run(send_and_close())
@@ -345,23 +345,32 @@ const AzureVMAPI = {
     const endpoint = `${this._baseUrl()}/pending-messages?from_sender=${encodeURIComponent(AppState.userId)}`;
 
     try {
-      const res = await fetch(endpoint, {
-        method: 'GET',
-        headers: { 'Accept': 'application/json' }
-      });
-
-      if (!res.ok) {
-        let msg = `HTTP ${res.status}: ${res.statusText}`;
-        try {
-          const data = await res.json();
-          msg = data.detail || data.error || data.message || msg;
-        } catch (e) {
-          try { const text = await res.text(); if (text) msg = text; } catch (_) {}
+      // The server returns one page at a time; follow X-Next-Cursor to the end.
+      // Pages carry an ETag, so unchanged pages are revalidated with a 304.
+      const data = [];
+      let cursor = null;
+      do {
+        const url = cursor ? `${endpoint}&cursor=${encodeURIComponent(cursor)}` : endpoint;
+        const res = await fetch(url, {
+          method: 'GET',
+          headers: { 'Accept': 'application/json' }
+        });
+
+        if (!res.ok) {
+          let msg = `HTTP ${res.status}: ${res.statusText}`;
+          try {
+            const body = await res.json();
+            msg = body.detail || body.error || body.message || msg;
+          } catch (e) {
+            try { const text = await res.text(); if (text) msg = text; } catch (_) {}
+          }
+          throw new Error(msg);
         }
-        throw new Error(msg);
-      }
 
-      const data = await res.json();
+        data.push(...await res.json());
+        cursor = res.headers.get('X-Next-Cursor');
+      } while (cursor);
+
       console.log('Pending messages for user:', AppState.userId, data);
       return data;
     } catch (err) {